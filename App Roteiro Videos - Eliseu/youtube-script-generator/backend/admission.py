@@ -0,0 +1,178 @@
+import asyncio
+import math
+import os
+import time
+from typing import Dict, Optional
+from metrics import metrics
+
+class AdmissionRejected(Exception):
+    """Pedido de geração recusado pelo controle de admissão"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code  # 429 = limite do usuário, 503 = servidor cheio
+        self.detail = detail
+        self.retry_after = retry_after
+
+class AdmissionSlot:
+    """Vaga de geração concedida; release é idempotente"""
+
+    def __init__(self, controller: "AdmissionController", user_key: Optional[str]):
+        self._controller = controller
+        self._user_key = user_key
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._user_key, time.monotonic() - self._started_at)
+
+class AdmissionController:
+    """
+    Limita quantas gerações rodam ao mesmo tempo, no total e por usuário
+
+    Acima do limite global os pedidos esperam numa fila limitada; com a fila
+    cheia (ou após esperar demais) são recusados na hora com 503, e um usuário
+    acima do seu limite recebe 429. Em ambos os casos vai junto um Retry-After
+    estimado pela duração média das gerações, em vez de deixar a latência de
+    todo mundo explodir.
+    """
+
+    def __init__(self, max_concurrent: int = 8, per_user: int = 2, max_waiting: int = 16,
+                 max_wait_seconds: float = 30):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._active = 0
+        self._waiting = 0
+        self._per_user: Dict[str, int] = {}
+        # Média móvel da duração de uma geração, para estimar o Retry-After
+        self._avg_duration = 60.0
+
+    async def acquire(self, user_id: Optional[str], background: bool = False) -> AdmissionSlot:
+        """
+        Reserva uma vaga de geração, esperando na fila se necessário
+
+        Args:
+            user_id: Usuário que pediu a geração
+            background: Para workers da fila de jobs, que já passaram por
+                check_backlog: só respeita o limite global e espera sem prazo
+
+        Returns:
+            A vaga, que deve ser liberada com release() ao fim da geração
+
+        Raises:
+            AdmissionRejected: Limite do usuário atingido, fila cheia ou espera longa demais
+        """
+        user_key = user_id or "anonymous"
+
+        if background:
+            await self._semaphore.acquire()
+            self._active += 1
+            return AdmissionSlot(self, None)
+
+        if self._per_user.get(user_key, 0) >= self.per_user:
+            metrics.increment("admission.rejected_user")
+            raise AdmissionRejected(
+                429,
+                f"Você já tem {self.per_user} gerações em andamento. Aguarde uma terminar.",
+                self._retry_after(1)
+            )
+
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            metrics.increment("admission.rejected_full")
+            raise AdmissionRejected(
+                503,
+                "Servidor ocupado gerando outros roteiros. Tente novamente em instantes.",
+                self._retry_after(self._waiting + 1)
+            )
+
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self._forget_user(user_key)
+            metrics.increment("admission.rejected_timeout")
+            raise AdmissionRejected(
+                503,
+                "Servidor ocupado gerando outros roteiros. Tente novamente em instantes.",
+                self._retry_after(self._waiting)
+            )
+        except BaseException:
+            self._forget_user(user_key)
+            raise
+        finally:
+            self._waiting -= 1
+
+        self._active += 1
+        metrics.increment("admission.admitted")
+        return AdmissionSlot(self, user_key)
+
+    def check_backlog(self, user_active: int, backlog: int) -> None:
+        """
+        Aplica os mesmos limites a quem enfileira jobs em segundo plano
+
+        Args:
+            user_active: Jobs do usuário na fila ou rodando
+            backlog: Jobs esperando na fila
+
+        Raises:
+            AdmissionRejected: Limite do usuário atingido ou fila cheia
+        """
+        if user_active >= self.per_user:
+            metrics.increment("admission.rejected_user")
+            raise AdmissionRejected(
+                429,
+                f"Você já tem {self.per_user} gerações em andamento. Aguarde uma terminar.",
+                self._retry_after(1)
+            )
+        if backlog >= self.max_waiting:
+            metrics.increment("admission.rejected_full")
+            raise AdmissionRejected(
+                503,
+                "Servidor ocupado gerando outros roteiros. Tente novamente em instantes.",
+                self._retry_after(backlog + 1)
+            )
+
+    def _retry_after(self, position: int) -> int:
+        # Cada "rodada" de max_concurrent gerações libera a fila na velocidade da duração média
+        rounds = max(1, math.ceil(position / self.max_concurrent))
+        return max(1, math.ceil(self._avg_duration * rounds))
+
+    def _forget_user(self, user_key: Optional[str]) -> None:
+        if user_key is None:
+            return
+        remaining = self._per_user.get(user_key, 0) - 1
+        if remaining > 0:
+            self._per_user[user_key] = remaining
+        else:
+            self._per_user.pop(user_key, None)
+
+    def _release(self, user_key: Optional[str], duration: float) -> None:
+        self._semaphore.release()
+        self._active -= 1
+        self._forget_user(user_key)
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def stats(self) -> Dict:
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "per_user": self.per_user,
+            "max_waiting": self.max_waiting,
+            "avg_duration": round(self._avg_duration, 1)
+        }
+
+def create_admission_controller() -> AdmissionController:
+    return AdmissionController(
+        max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "8")),
+        per_user=int(os.getenv("ADMISSION_PER_USER", "2")),
+        max_waiting=int(os.getenv("ADMISSION_MAX_WAITING", "16")),
+        max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+    )
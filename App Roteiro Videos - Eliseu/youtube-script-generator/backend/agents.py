@@ -1,15 +1,53 @@
-from typing import Dict, List, TypedDict, Annotated, Sequence
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict, Annotated, Sequence
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
-from langchain.schema import HumanMessage, BaseMessage
+from langchain.schema import AIMessage, HumanMessage, BaseMessage
+import asyncio
+import contextvars
 import operator
 import os
+import re
+import threading
+import time
 from dotenv import load_dotenv
 from script_utils import ScriptUtils
+from llm_cache import LLMResponseCache, response_cache
+from metrics import metrics
+from length_control import LengthController
+from checkpoints import checkpoint_store
+from hedging import HedgePolicy, hedged
+from token_budget import TokenBudget
 
 load_dotenv()
 
+class RegenerationConflict(Exception):
+    """O checkpoint não tem as saídas que a regeneração precisaria reaproveitar"""
+
+class GenerationContext:
+    """
+    Opções e contadores de uma geração em andamento
+    
+    Fica num ContextVar (e não na instância) para que gerações concorrentes no
+    mesmo MultiAgentSystem não se misturem.
+    """
+    
+    def __init__(self, progress_callback: Optional[Callable[[Dict], None]] = None,
+                 stream_tokens: bool = False, bypass_llm_cache: bool = False,
+                 drafting_mode: Optional[str] = None, generation_id: Optional[str] = None,
+                 owner_id: Optional[str] = None):
+        self.progress_callback = progress_callback  # Destino dos eventos de progresso
+        self.stream_tokens = stream_tokens  # Se eliseu/revisor transmitem tokens ao callback
+        self.bypass_llm_cache = bypass_llm_cache  # Se ignora o cache de respostas do LLM
+        self.drafting_mode = drafting_mode  # Sobrescreve SCRIPT_DRAFTING_MODE nesta geração
+        self.generation_id = generation_id  # Chave dos checkpoints (None = sem checkpoint)
+        self.owner_id = owner_id  # Usuário dono da geração, gravado no checkpoint
+        self.output_tokens = 0
+        self.llm_calls = 0
+        self.started_at = time.monotonic()
+
+_generation: contextvars.ContextVar[GenerationContext] = contextvars.ContextVar("generation", default=GenerationContext())
+
 class ScriptState(TypedDict):
     videos: List[Dict]
     topic: str
@@ -21,10 +59,35 @@ class ScriptState(TypedDict):
     raw_script: str
     final_script: str
     messages: Annotated[Sequence[BaseMessage], operator.add]
+    resume_from: str  # Nó de entrada ao retomar uma geração; vazio = início
 
 class MultiAgentSystem:
+    # Marcador da seção estruturada de tendências na resposta do analista
+    TRENDS_MARKER = "### TENDÊNCIAS"
+    # Ordem dos nós do grafo (usada para retomar a partir de um checkpoint)
+    NODE_ORDER = ["pesquisador", "analista", "roteirista", "eliseu", "revisor"]
+    # Primeiro nó afetado por cada entrada que pode mudar numa regeneração parcial
+    # (pesquisa e análise não dependem de nenhuma delas)
+    REGENERATION_ENTRY = {"personality_prompt": "eliseu", "target_minutes": "roteirista"}
+    
     def __init__(self, model_provider: str = "gpt-4.1"):
         self.model_provider = model_provider
+        self.model_name = None
+        self.temperature = 0.7
+        self.response_cache = response_cache
+        self.length_controller = LengthController()
+        self.checkpoints = checkpoint_store
+        
+        # Hedge: se o provider principal demorar mais que o percentil configurado
+        # num nó, a mesma chamada vai para LLM_HEDGE_PROVIDER e vence quem terminar antes
+        self.hedge_policy = HedgePolicy()
+        if self.hedge_policy.provider == model_provider:
+            self.hedge_policy.provider = ""
+        
+        # Rascunho do roteirista: "single" (uma completion), "sections" (esboço +
+        # seções em paralelo) ou "auto" (seções só para vídeos longos)
+        self.drafting_mode = os.getenv("SCRIPT_DRAFTING_MODE", "auto").lower()
+        self.section_drafting_min_minutes = int(os.getenv("SECTION_DRAFTING_MIN_MINUTES", "15"))
         
         # Anthropic models
         if model_provider in ["claude-sonnet-4", "claude-opus-4.1"]:
@@ -42,9 +105,10 @@ class MultiAgentSystem:
                     "claude-opus-4.1": "claude-opus-4-1-20250805"
                 }
                 selected_model = model_map[model_provider]
+                self.model_name = selected_model
                 self.llm = ChatAnthropic(
                     model=selected_model,
-                    temperature=0.7,
+                    temperature=self.temperature,
                     api_key=anthropic_api_key,
                     max_tokens=4096
                 )
@@ -66,14 +130,17 @@ class MultiAgentSystem:
                     "gpt-5": "gpt-4-turbo-preview"     # GPT-5 not released yet, using GPT-4 turbo
                 }
                 selected_model = model_map.get(model_provider, "gpt-4-turbo-preview")
+                self.model_name = selected_model
                 self.llm = ChatOpenAI(
                     model=selected_model,
-                    temperature=0.7,
-                    api_key=openai_api_key
+                    temperature=self.temperature,
+                    api_key=openai_api_key,
+                    stream_usage=True
                 )
                 print(f"DEBUG: Using {model_provider} ({selected_model})")
+        # Contagem local de tokens e orçamento de entrada por nó
+        self.token_budget = TokenBudget(self.model_provider, self.model_name)
         self.graph = self._build_graph()
-        self.progress_callback = None
         self.agent_info = {
             "pesquisador": {"name": "🔍 Pesquisador", "description": "Analisando vídeos em alta..."},
             "analista": {"name": "📊 Analista", "description": "Identificando tendências virais..."},
@@ -85,13 +152,16 @@ class MultiAgentSystem:
     def _build_graph(self):
         workflow = StateGraph(ScriptState)
         
-        workflow.add_node("pesquisador", self.pesquisador_agent)
-        workflow.add_node("analista", self.analista_agent)
-        workflow.add_node("roteirista", self.roteirista_agent)
-        workflow.add_node("eliseu", self.eliseu_agent)
-        workflow.add_node("revisor", self.revisor_agent)
+        workflow.add_node("pesquisador", self._tracked("pesquisador", 1, self.pesquisador_agent))
+        workflow.add_node("analista", self._tracked("analista", 2, self.analista_agent))
+        workflow.add_node("roteirista", self._tracked("roteirista", 3, self.roteirista_agent))
+        workflow.add_node("eliseu", self._tracked("eliseu", 4, self.eliseu_agent))
+        workflow.add_node("revisor", self._tracked("revisor", 5, self.revisor_agent))
         
-        workflow.set_entry_point("pesquisador")
+        workflow.set_conditional_entry_point(
+            self._entry_node,
+            {node: node for node in self.NODE_ORDER}
+        )
         workflow.add_edge("pesquisador", "analista")
         workflow.add_edge("analista", "roteirista")
         workflow.add_edge("roteirista", "eliseu")
@@ -100,27 +170,260 @@ class MultiAgentSystem:
         
         return workflow.compile()
     
-    async def _notify_progress(self, agent_name: str, step: int, total_steps: int = 5):
-        """Notifica o progresso para o callback se disponível"""
-        if self.progress_callback:
-            agent_data = self.agent_info.get(agent_name, {})
-            await self.progress_callback({
-                "step": step,
-                "total": total_steps,
-                "agent": agent_data.get("name", agent_name),
-                "description": agent_data.get("description", "Processando..."),
-                "percentage": int((step / total_steps) * 100)
-            })
-    
-    def pesquisador_agent(self, state: ScriptState) -> ScriptState:
-        """Agente que organiza e analisa os dados dos vídeos"""
-        # Notifica progresso se possível
-        if self.progress_callback:
-            import asyncio
-            loop = asyncio.new_event_loop()
-            loop.run_until_complete(self._notify_progress("pesquisador", 1))
-            loop.close()
+    def _entry_node(self, state: ScriptState) -> str:
+        return state.get("resume_from") or self.NODE_ORDER[0]
+    
+    def _tracked(self, agent_name: str, step: int, agent_fn: Callable[[ScriptState], Awaitable[Dict]]) -> Callable[[ScriptState], Awaitable[Dict]]:
+        """Envolve um nó do grafo emitindo eventos reais de início e fim com o tempo gasto"""
+        async def node(state: ScriptState) -> Dict:
+            self._notify_progress(agent_name, step, "started")
+            started_at = time.monotonic()
+            result = await agent_fn(state)
+            self._notify_progress(agent_name, step, "finished", elapsed=time.monotonic() - started_at)
+            await self._save_checkpoint(agent_name, state, result)
+            return result
+        return node
+    
+    async def _save_checkpoint(self, agent_name: str, state: ScriptState, result: Dict) -> None:
+        """Persiste o estado acumulado após o nó, se a geração atual tiver generation_id"""
+        generation = _generation.get()
+        if not generation.generation_id or not self.checkpoints.enabled:
+            return
+        
+        snapshot = {**state, **result, "messages": list(state["messages"]) + list(result.get("messages", []))}
+        status = "completed" if agent_name == self.NODE_ORDER[-1] else "running"
+        try:
+            await asyncio.to_thread(
+                self.checkpoints.save, generation.generation_id, snapshot, agent_name,
+                status, generation.owner_id
+            )
+        except Exception as e:
+            # Checkpoint é só para retomada; não derruba a geração
+            print(f"Erro ao salvar checkpoint de {agent_name}: {str(e)}")
+    
+    def _notify_progress(self, agent_name: str, step: int, status: str, elapsed: Optional[float] = None, total_steps: int = 5):
+        """Notifica o progresso para o callback da geração atual, se houver"""
+        sink = _generation.get().progress_callback
+        if not sink:
+            return
+        
+        agent_data = self.agent_info.get(agent_name, {})
+        completed_steps = step if status == "finished" else step - 1
+        event = {
+            "type": "progress",
+            "step": step,
+            "total": total_steps,
+            "node": agent_name,
+            "status": status,
+            "agent": agent_data.get("name", agent_name),
+            "description": agent_data.get("description", "Processando..."),
+            "percentage": int((completed_steps / total_steps) * 100)
+        }
+        if elapsed is not None:
+            event["elapsed"] = round(elapsed, 2)
+        sink(event)
+    
+    async def _call_llm(self, prompt: str, agent_name: str, stream: bool = False, cacheable: bool = False,
+                        call_type: str = "full"):
+        """
+        Chama o LLM para um nó do grafo
+        
+        Com stream=True e o modo de streaming ativo na geração atual, os tokens
+        são repassados ao progress_sink conforme chegam ("stream_start" marca o
+        início de uma nova versão do roteiro; o cliente deve descartar a anterior).
+        
+        Com cacheable=True a resposta passa pelo cache de respostas do LLM
+        (se habilitado e não ignorado pela geração atual).
         
+        call_type separa, dentro do mesmo nó, chamadas de tamanhos muito
+        diferentes ("full", "outline", "section", "section_fix"), para que a
+        latência de uma não defina o prazo de hedge da outra.
+        
+        Returns:
+            A mensagem completa de resposta do LLM
+        """
+        prompt_tokens = self.token_budget.counter.count(prompt)
+        budget = self.token_budget.budget_for(agent_name)
+        metrics.increment(f"tokens.input_estimated.{agent_name}", prompt_tokens)
+        if budget is not None and prompt_tokens > budget:
+            # Só as partes obrigatórias (ex.: o roteiro a reescrever) já passam do orçamento
+            print(f"Warning: Prompt do {agent_name} com {prompt_tokens} tokens, acima do orçamento de {budget}")
+            metrics.increment(f"tokens.over_budget.{agent_name}")
+        
+        if cacheable and self.response_cache.enabled:
+            if _generation.get().bypass_llm_cache:
+                self.response_cache.count_bypass()
+            else:
+                return await self._call_llm_cached(prompt, agent_name, prompt_tokens, call_type)
+        
+        return await self._call_llm_uncached(prompt, agent_name, stream, prompt_tokens, call_type)
+    
+    async def _call_llm_cached(self, prompt: str, agent_name: str, prompt_tokens: int = 0, call_type: str = "full"):
+        key = LLMResponseCache.make_key(self.model_name or self.model_provider, self.temperature, prompt)
+        try:
+            cached = await asyncio.to_thread(self.response_cache.get, key)
+        except Exception as e:
+            print(f"Erro ao ler cache do LLM ({agent_name}): {str(e)}")
+            cached = None
+        
+        if cached is not None:
+            print(f"DEBUG: Cache do LLM acertou para {agent_name}")
+            return AIMessage(content=cached)
+        
+        response, winner = await self._request_llm(prompt, agent_name, prompt_tokens=prompt_tokens, call_type=call_type)
+        if winner == "secondary":
+            # A chave é do modelo principal; a resposta do provider de reserva não pode ficar sob ela
+            print(f"DEBUG: Resposta de {agent_name} veio do provider de reserva; não vai para o cache")
+            return response
+        try:
+            await asyncio.to_thread(self.response_cache.set, key, response.content)
+        except Exception as e:
+            print(f"Erro ao gravar cache do LLM ({agent_name}): {str(e)}")
+        return response
+    
+    async def _call_llm_uncached(self, prompt: str, agent_name: str, stream: bool = False, prompt_tokens: int = 0,
+                                 call_type: str = "full"):
+        response, _ = await self._request_llm(prompt, agent_name, stream, prompt_tokens, call_type)
+        return response
+    
+    async def _request_llm(self, prompt: str, agent_name: str, stream: bool = False, prompt_tokens: int = 0,
+                           call_type: str = "full") -> Tuple[Any, str]:
+        """
+        Returns:
+            Tupla (resposta, "primary" ou "secondary" conforme o provider que respondeu)
+        """
+        messages = [HumanMessage(content=prompt)]
+        generation = _generation.get()
+        sink = generation.progress_callback
+        
+        if stream and sink and generation.stream_tokens:
+            sink({"type": "stream_start", "node": agent_name})
+            # No streaming o hedge decide pelo primeiro token; depois segue só com o vencedor
+            (iterator, chunk), winner = await self._invoke_hedged(
+                agent_name, "first_token", lambda llm: self._first_chunk(llm, messages), call_type,
+                discard=lambda started: self._close_stream(started[0])
+            )
+            response = None
+            try:
+                while chunk is not None:
+                    if isinstance(chunk.content, str) and chunk.content:
+                        sink({"type": "token", "node": agent_name, "delta": chunk.content})
+                    response = chunk if response is None else response + chunk
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        chunk = None
+            finally:
+                # Cancelamento no meio do stream (cliente desconectou) também fecha a conexão
+                await self._close_stream(iterator)
+        else:
+            response, winner = await self._invoke_hedged(
+                agent_name, "response", lambda llm: llm.ainvoke(messages), call_type
+            )
+        
+        self._record_usage(response, generation, agent_name, prompt_tokens)
+        return response, winner
+    
+    @classmethod
+    async def _first_chunk(cls, llm, messages: List[BaseMessage]) -> Tuple:
+        iterator = llm.astream(messages).__aiter__()
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            # Inclui o cancelamento da tentativa que perdeu o hedge: fecha o stream do provider
+            await cls._close_stream(iterator)
+            raise
+        return iterator, first
+    
+    @staticmethod
+    async def _close_stream(iterator) -> None:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    
+    def _hedge_llm(self):
+        # Reaproveita o cliente (e o pool de conexões) do sistema do provider de reserva
+        provider = self.hedge_policy.provider
+        if not provider or provider not in AgentSystemRegistry.SUPPORTED_PROVIDERS:
+            return None
+        return agent_registry.get(provider).llm
+    
+    async def _invoke_hedged(self, agent_name: str, kind: str, call: Callable[[Any], Awaitable[Any]],
+                             call_type: str = "full", discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Tuple[Any, str]:
+        """
+        Executa call no LLM principal, com hedge no provider de reserva se o nó tiver política
+        
+        Args:
+            agent_name: Nó do grafo
+            kind: "response" (resposta completa) ou "first_token" (streaming)
+            call: Recebe o cliente do LLM e devolve a coroutine da chamada
+            call_type: Tipo da chamada dentro do nó (ver _call_llm); cada um tem sua janela de latência
+            discard: Libera o resultado da tentativa perdedora (ver hedging.hedged)
+        
+        Returns:
+            Tupla (resultado, "primary" ou "secondary")
+        """
+        key = f"{agent_name}:{call_type}:{kind}"
+        delay = self.hedge_policy.delay_for(key, agent_name)
+        hedge_llm = self._hedge_llm() if delay is not None else None
+        
+        if hedge_llm is None:
+            started_at = time.monotonic()
+            result = await call(self.llm)
+            self.hedge_policy.latencies.record(key, time.monotonic() - started_at)
+            return result, "primary"
+        
+        result, winner, elapsed = await hedged(
+            lambda: call(self.llm), lambda: call(hedge_llm), delay, label=f"{agent_name}/{call_type}/{kind}",
+            discard=discard
+        )
+        if winner == "primary" or elapsed >= delay:
+            # Se o principal perdeu, o tempo até ser abandonado é um limite inferior da latência dele
+            self.hedge_policy.latencies.record(key, elapsed)
+        if elapsed >= delay or winner == "secondary":
+            provider = self.model_provider if winner == "primary" else self.hedge_policy.provider
+            print(f"DEBUG: Hedge {agent_name}/{call_type}/{kind}: venceu {winner} ({provider}) em {elapsed:.1f}s")
+            metrics.increment(f"hedge.won_{winner}")
+        return result, winner
+    
+    def _record_usage(self, response, generation: GenerationContext, agent_name: str, prompt_tokens: int) -> None:
+        """Soma os tokens informados pelo provider na geração atual e compara a entrada com o orçamento"""
+        generation.llm_calls += 1
+        usage = getattr(response, "usage_metadata", None) or {}
+        output_tokens = usage.get("output_tokens", 0)
+        generation.output_tokens += output_tokens
+        metrics.increment("llm.calls")
+        metrics.increment("llm.output_tokens", output_tokens)
+        
+        input_tokens = usage.get("input_tokens")
+        if input_tokens is not None:
+            metrics.increment(f"tokens.input_actual.{agent_name}", input_tokens)
+        print(
+            f"DEBUG: Tokens de entrada {agent_name}: {input_tokens if input_tokens is not None else '?'} reais, "
+            f"{prompt_tokens} estimados, orçamento {self.token_budget.budget_for(agent_name) or '-'}"
+        )
+    
+    @staticmethod
+    def _slot(name: str) -> str:
+        """Marcador de uma parte aparável do prompt, trocada pelo texto final em _fill_slots"""
+        return f"⟦{name}⟧"
+    
+    def _fit_parts(self, agent_name: str, prompt: str, parts: List[Dict]) -> Dict[str, str]:
+        """Apara as partes opcionais para o prompt (montado com _slot) caber no orçamento do nó"""
+        template = prompt
+        for part in parts:
+            template = template.replace(self._slot(part["name"]), "")
+        return self.token_budget.fit(agent_name, self.token_budget.counter.count(template), parts)
+    
+    def _fill_slots(self, text: str, texts: Dict[str, str]) -> str:
+        for name, value in texts.items():
+            text = text.replace(self._slot(name), value)
+        return text
+    
+    async def pesquisador_agent(self, state: ScriptState) -> Dict:
+        """Agente que organiza e analisa os dados dos vídeos"""
         videos = state["videos"]
         topic = state["topic"]
         
@@ -128,6 +431,7 @@ class MultiAgentSystem:
         videos_with_transcripts = [v for v in videos if v.get('has_transcript', False)]
         
         transcript_analysis = ""
+        transcript_parts = []
         if videos_with_transcripts:
             transcript_analysis = "\n\nANÁLISE DETALHADA DAS TRANSCRIÇÕES DOS VÍDEOS MAIS HYPADOS:\n"
             for i, video in enumerate(videos_with_transcripts[:3], 1):
@@ -137,9 +441,11 @@ class MultiAgentSystem:
                 Engagement: {video.get('engagement_score', 0):.2f}% | Views: {video['views']:,}
                 
                 CONTEÚDO REAL DO VÍDEO:
-                {video.get('transcript_summary', '')}
+                {self._slot(f'transcript_{i}')}
                 
                 ---"""
+                # Transcrições dos vídeos menos engajados são as primeiras a serem aparadas
+                transcript_parts.append({"name": f"transcript_{i}", "text": video.get('transcript_summary', ''), "priority": i})
         
         prompt = f"""
         Você é um agente pesquisador especializado em YouTube com acesso às TRANSCRIÇÕES REAIS dos vídeos hypados.
@@ -161,12 +467,12 @@ class MultiAgentSystem:
         IMPORTANTE: Priorize insights das transcrições reais em vez de apenas metadados.
         Seja específico e detalhado com base no conteúdo real dos vídeos.
         """
+        prompt = self._fill_slots(prompt, self._fit_parts("pesquisador", prompt, transcript_parts))
         
-        response = self.llm.invoke([HumanMessage(content=prompt)])
-        state["messages"].append(response)
-        return state
+        response = await self._call_llm(prompt, "pesquisador", cacheable=True)
+        return {"messages": [response]}
     
-    def analista_agent(self, state: ScriptState) -> ScriptState:
+    async def analista_agent(self, state: ScriptState) -> Dict:
         """Agente que identifica tendências e sugere tópicos-chave baseado em transcrições reais"""
         last_message = state["messages"][-1].content if state["messages"] else ""
         videos = state["videos"]
@@ -202,24 +508,70 @@ class MultiAgentSystem:
         
         IMPORTANTE: Base suas recomendações no CONTEÚDO REAL dos vídeos hypados, não em teorias.
         Forneça insights específicos e acionáveis para replicar o sucesso viral.
-        """
         
-        response = self.llm.invoke([HumanMessage(content=prompt)])
+        FORMATO DA RESPOSTA:
+        Escreva a análise completa. Depois dela, termine com a seção abaixo, exatamente
+        neste formato, listando os 5 principais tópicos/tendências (um por linha, sem comentários):
         
-        trends_prompt = f"""
-        Extraia apenas uma lista com os 5 principais tópicos/tendências mencionados.
-        
-        Texto: {response.content}
+        {self.TRENDS_MARKER}
+        - tendência 1
+        - tendência 2
+        - tendência 3
+        - tendência 4
+        - tendência 5
+        """
         
-        Retorne apenas a lista, um item por linha.
+        response = await self._call_llm(prompt, "analista", cacheable=True)
+        analysis, trends = self._parse_analysis(response.content)
+        return {"trends": trends, "messages": [AIMessage(content=analysis)]}
+    
+    def _parse_analysis(self, content: str, max_trends: int = 5) -> Tuple[str, List[str]]:
         """
+        Separa a análise da lista estruturada de tendências da resposta do analista
+        
+        Se o modelo não respeitar o marcador, extrai os itens numerados ou com
+        marcadores da própria análise em vez de fazer outra chamada ao LLM.
         
-        trends_response = self.llm.invoke([HumanMessage(content=trends_prompt)])
-        state["trends"] = trends_response.content.split('\n')
-        state["messages"].append(response)
-        return state
+        Returns:
+            Tupla (análise, lista de tendências)
+        """
+        item_pattern = re.compile(r'^\s*(?:\d+[\.\)]|[-*•])\s+(.+)$')
+        
+        def clean(item: str) -> str:
+            return re.sub(r'[*_#`]', '', item).strip().rstrip(':').strip()
+        
+        marker_index = content.find(self.TRENDS_MARKER)
+        if marker_index >= 0:
+            analysis = content[:marker_index].rstrip()
+            section = content[marker_index + len(self.TRENDS_MARKER):]
+            trends = []
+            for line in section.split('\n'):
+                match = item_pattern.match(line)
+                item = clean(match.group(1) if match else line)
+                if item:
+                    trends.append(item)
+            if trends:
+                return analysis, trends[:max_trends]
+        else:
+            analysis = content.strip()
+        
+        # Fallback local: primeiros itens de lista da análise
+        trends = []
+        for line in analysis.split('\n'):
+            match = item_pattern.match(line)
+            if match:
+                item = clean(match.group(1))
+                if item:
+                    trends.append(item)
+            if len(trends) >= max_trends:
+                break
+        
+        if not trends:
+            trends = [clean(line) for line in analysis.split('\n') if clean(line)][:max_trends]
+        
+        return analysis, trends
     
-    def roteirista_agent(self, state: ScriptState) -> ScriptState:
+    async def roteirista_agent(self, state: ScriptState) -> Dict:
         """Agente que cria a estrutura do roteiro"""
         last_message = state["messages"][-1].content if state["messages"] else ""
         trends = state.get("trends", [])
@@ -254,11 +606,16 @@ class MultiAgentSystem:
             desenvolvimento_time = f"{target_minutes - 8} minutos"
             pontos_principais = "7-10 pontos principais com exemplos detalhados"
         
+        budget_instructions = self.length_controller.format_budget_instructions(
+            self.length_controller.allocate(target_minutes)
+        )
+        
         # Verifica se temos transcrições para usar como referência
         videos = state["videos"]
         videos_with_transcripts = [v for v in videos if v.get('has_transcript', False)]
         
         transcript_reference = ""
+        reference_parts = []
         if videos_with_transcripts:
             transcript_reference = "\n\nREFERÊNCIAS DE ESTRUTURA DOS VÍDEOS HYPADOS:\n"
             for i, video in enumerate(videos_with_transcripts[:2], 1):
@@ -266,8 +623,14 @@ class MultiAgentSystem:
                 
                 REFERÊNCIA {i} - {video['title']} ({video.get('engagement_score', 0):.1f}% engagement):
                 Estrutura real usada no vídeo:
-                {video.get('transcript_summary', '')[:800]}
+                {self._slot(f'reference_{i}')}
                 ---"""
+                reference_parts.append({
+                    "name": f"reference_{i}",
+                    "text": video.get('transcript_summary', ''),
+                    "priority": i + 1,
+                    "max_tokens": 250
+                })
         
         prompt = f"""
         Você é um roteirista profissional de YouTube com acesso às TRANSCRIÇÕES dos vídeos mais hypados do nicho.
@@ -276,6 +639,8 @@ class MultiAgentSystem:
         
         DURAÇÃO ALVO: {target_minutes} minutos (~{target_words} palavras)
         
+        {budget_instructions}
+        
         ANÁLISE BASEADA EM CONTEÚDO REAL:
         {last_message}
         
@@ -361,13 +726,189 @@ class MultiAgentSystem:
         ✅ TERMINE com a última fala do Eliseu, SEM comentários adicionais
         ✅ APENAS o roteiro puro no formato profissional solicitado
         """
+        fitted = self._fit_parts("roteirista", prompt, reference_parts)
+        prompt = self._fill_slots(prompt, fitted)
+        transcript_reference = self._fill_slots(transcript_reference, fitted)
+        
+        if self._use_section_drafting(target_minutes):
+            drafted = await self._draft_by_sections(state, last_message, trends, transcript_reference)
+            if drafted:
+                return drafted
+            print("Warning: Rascunho por seções falhou. Usando geração em uma única chamada.")
+        
+        response = await self._call_llm(prompt, "roteirista")
+        return {"raw_script": response.content, "script_structure": {"mode": "single"}, "messages": [response]}
+    
+    def _use_section_drafting(self, target_minutes: int) -> bool:
+        mode = (_generation.get().drafting_mode or self.drafting_mode).lower()
+        if mode == "sections":
+            return True
+        if mode == "auto":
+            return target_minutes >= self.section_drafting_min_minutes
+        return False
+    
+    async def _draft_by_sections(self, state: ScriptState, analysis: str, trends: List[str],
+                                 transcript_reference: str) -> Optional[Dict]:
+        """
+        Rascunha o roteiro por seções: um esboço curto e depois todas as seções em paralelo
+        
+        O tempo total passa a ser o da seção mais longa (mais o esboço) em vez da
+        soma de todas, o que importa nos roteiros de 20-30 minutos.
+        
+        Args:
+            state: Estado atual do grafo
+            analysis: Análise do analista
+            trends: Tendências identificadas
+            transcript_reference: Trechos das transcrições de referência
+        
+        Returns:
+            Atualização parcial do estado ou None se o esboço não puder ser usado
+        """
+        topic = state["topic"]
+        target_minutes = state["target_minutes"]
+        personality_prompt = state["personality_prompt"]
+        budgets = self.length_controller.allocate(target_minutes)
+        
+        outline = await self._draft_outline(topic, target_minutes, analysis, trends, budgets, personality_prompt)
+        if not outline:
+            return None
+        
+        outline_text = "\n        ".join(f"- [{section['title']}]: {section['plan']}" for section in outline)
+        results = await asyncio.gather(
+            *(self._draft_section(section, outline_text, state, transcript_reference) for section in outline),
+            return_exceptions=True
+        )
+        
+        sections = []
+        for section, result in zip(outline, results):
+            if isinstance(result, Exception):
+                print(f"Erro ao rascunhar seção '{section['title']}': {str(result)}")
+                return None
+            sections.append((section, result))
+        
+        raw_script = self._stitch_sections(sections)
+        metrics.increment("roteirista.section_drafts")
+        metrics.increment("roteirista.sections_drafted", len(sections))
+        return {
+            "raw_script": raw_script,
+            "script_structure": {"mode": "sections", "outline": outline},
+            "messages": [AIMessage(content=raw_script)]
+        }
+    
+    async def _draft_outline(self, topic: str, target_minutes: int, analysis: str, trends: List[str],
+                             budgets: List[Dict], personality_prompt: str) -> Optional[List[Dict]]:
+        """Pede um esboço compacto com o plano de cada seção do orçamento"""
+        sections_list = "\n        ".join(f"[{budget['title']}]: <plano em uma ou duas frases>" for budget in budgets)
+        
+        prompt = f"""
+        Você é um roteirista profissional de YouTube. Planeje um vídeo de {target_minutes} minutos sobre "{topic}".
+        
+        ANÁLISE BASEADA EM CONTEÚDO REAL:
+        {analysis}
+        
+        Tendências identificadas: {', '.join(trends)}
+        {f'Estilo desejado: {personality_prompt}' if personality_prompt else ''}
+        
+        Responda SOMENTE com uma linha por seção, exatamente neste formato e nesta ordem:
+        {sections_list}
+        
+        - Cada ponto de desenvolvimento deve cobrir um assunto diferente, sem repetir os outros
+        - O gancho promete o que o clímax entrega
+        - Não escreva o roteiro, só o plano
+        """
         
-        response = self.llm.invoke([HumanMessage(content=prompt)])
-        state["raw_script"] = response.content
-        state["messages"].append(response)
-        return state
+        response = await self._call_llm(prompt, "roteirista", call_type="outline")
+        return self._parse_outline(response.content, budgets)
+    
+    def _parse_outline(self, content: str, budgets: List[Dict]) -> Optional[List[Dict]]:
+        """
+        Associa cada linha do esboço à seção do orçamento pelo título
+        
+        Returns:
+            As seções do orçamento com 'plan', ou None se faltar o plano de alguma
+        """
+        plans = {}
+        for line in content.split('\n'):
+            match = re.match(r'^\s*[-*]?\s*\[([^\]]+)\]\s*:?\s*(.+)$', line)
+            if match:
+                plans[match.group(1).strip().upper()] = match.group(2).strip()
+        
+        outline = []
+        for budget in budgets:
+            plan = plans.get(budget["title"].upper())
+            if not plan:
+                return None
+            outline.append({**budget, "plan": plan})
+        return outline
     
-    def eliseu_agent(self, state: ScriptState) -> ScriptState:
+    async def _draft_section(self, section: Dict, outline_text: str, state: ScriptState,
+                             transcript_reference: str) -> str:
+        """Escreve uma única seção do roteiro a partir do esboço completo"""
+        personality_prompt = state["personality_prompt"]
+        position_rules = {
+            "hook": "Abra o vídeo com uma pergunta impactante ou afirmação polêmica e prometa o que o viewer vai aprender.",
+            "intro": "Contextualize rápido e diga por que o assunto importa AGORA. Não repita o gancho.",
+            "development": "Entre direto no assunto deste ponto, sem cumprimentar nem reapresentar o vídeo. Use exemplos práticos, dados e storytelling.",
+            "climax": "Entregue a revelação principal prometida no gancho (o momento \"aha\").",
+            "conclusion": "Recapitule rapidamente os pontos e mostre a aplicação prática.",
+            "cta": "Peça uma ação específica e o like/inscrição de forma contextualizada. Termine o vídeo aqui.",
+        }
+        
+        prompt = f"""
+        Você é um roteirista profissional de YouTube escrevendo UMA seção de um roteiro sobre "{state['topic']}".
+        As outras seções estão sendo escritas em paralelo seguindo o mesmo esboço:
+        {outline_text}
+        
+        ESCREVA AGORA APENAS: [{section['title']}]
+        Plano desta seção: {section['plan']}
+        {position_rules[section['kind']]}
+        {f'Estilo: {personality_prompt}' if personality_prompt else ''}
+        {transcript_reference if section['kind'] in ('hook', 'intro') else ''}
+        
+        🎯 TAMANHO: ~{section['words']} palavras FALADAS (não conte [indicações entre colchetes])
+        
+        FORMATO:
+        [{section['title']}]
+        Eliseu 👤: Fala para a câmera...
+        
+        [INDICAÇÃO VISUAL - o que mostrar]
+        Eliseu 👤: Continua a fala...
+        
+        ❌ NÃO escreva outras seções nem antecipe o conteúdo delas
+        ❌ NÃO faça comentários sobre o roteiro nem use markdown
+        ✅ Responda só com a seção
+        """
+        
+        response = await self._call_llm(prompt, "roteirista", call_type="section")
+        return response.content
+    
+    def _stitch_sections(self, sections: List[Tuple[Dict, str]]) -> str:
+        """
+        Junta as seções numa ordem fixa com uma passada local de consistência
+        
+        Garante o marcador de cada seção, remove marcadores de outras seções que o
+        modelo tenha antecipado, markdown e comentários sobre o roteiro.
+        """
+        parts = []
+        for section, text in sections:
+            kept = []
+            for line in text.strip().split('\n'):
+                line = re.sub(r'\*\*(.+?)\*\*', r'\1', line)
+                line = re.sub(r'^\s*#+\s*', '', line)
+                stripped = line.strip()
+                if self.length_controller.is_section_marker(stripped):
+                    # Só o marcador da própria seção é aceito (e é recolocado abaixo)
+                    continue
+                if re.match(r'^(Este roteiro|Esta seção|Essa seção|Observação:|Nota:)', stripped, re.IGNORECASE):
+                    continue
+                kept.append(line)
+            
+            body = '\n'.join(kept).strip()
+            parts.append(f"[{section['title']}]\n{body}")
+        
+        return '\n\n'.join(parts)
+    
+    async def eliseu_agent(self, state: ScriptState) -> Dict:
         """Agente que reescreve no estilo personalizado ou do Eliseu"""
         raw_script = state.get("raw_script", "")
         personality_prompt = state.get("personality_prompt", "")
@@ -401,6 +942,9 @@ class MultiAgentSystem:
         🚨 META CRÍTICA DE DURAÇÃO: {target_minutes} minutos
         🎯 PALAVRAS NECESSÁRIAS: {min_words} - {max_words} (ideal: {target_words})
         
+        {self.length_controller.format_budget_instructions(self.length_controller.allocate(target_minutes))}
+        Mantenha cada seção próxima do seu orçamento.
+        
         ⚠️ IMPORTANTE: O roteiro atual pode estar muito CURTO. 
         Você DEVE expandir o conteúdo para atingir pelo menos {min_words} palavras FALADAS.
         
@@ -493,11 +1037,10 @@ class MultiAgentSystem:
         ✅ SEM comentários adicionais após a última fala
         """
         
-        response = self.llm.invoke([HumanMessage(content=prompt)])
-        state["messages"].append(response)
-        return state
+        response = await self._call_llm(prompt, "eliseu", stream=True)
+        return {"messages": [response]}
     
-    def revisor_agent(self, state: ScriptState) -> ScriptState:
+    async def revisor_agent(self, state: ScriptState) -> Dict:
         """Agente que faz a revisão final e ajusta o tempo precisamente com validação rigorosa"""
         last_message = state["messages"][-1].content if state["messages"] else ""
         target_minutes = state.get("target_minutes", 10)
@@ -512,6 +1055,28 @@ class MultiAgentSystem:
         min_words = target_words - 50  # Margem mínima
         max_words = target_words + 50  # Margem máxima
         
+        # Caminho rápido: o roteiro do eliseu já está na faixa e no formato certo,
+        # então dispensa a chamada mais cara do pipeline
+        if min_words <= word_count <= max_words:
+            format_problems = script_utils.check_script_format(last_message)
+            if not format_problems:
+                metrics.increment("revisor.fast_path")
+                print(f"DEBUG: Revisor fast path - {word_count} palavras já na faixa {min_words}-{max_words}")
+                return self._final_script_update(last_message)
+            print(f"DEBUG: Revisor sem fast path - formato: {', '.join(format_problems)}")
+        elif not script_utils.check_script_format(last_message):
+            # Formato certo, tamanho errado: corrige só as seções fora do orçamento
+            adjusted = await self.length_controller.adjust(
+                last_message, target_minutes, lambda section: self._regenerate_section(section, state)
+            )
+            if self.length_controller.within_window(adjusted, target_minutes):
+                metrics.increment("revisor.length_controlled")
+                return self._final_script_update(adjusted)
+            last_message = adjusted
+            spoken_text, word_count = script_utils.extract_spoken_words(last_message)
+            actual_duration = script_utils.calculate_duration(word_count)
+        metrics.increment("revisor.llm_path")
+        
         # Determina a ação necessária
         if word_count < min_words:
             action_needed = f"🚨 ROTEIRO MUITO CURTO! Adicione {min_words - word_count} palavras FALADAS mínimo"
@@ -627,64 +1192,52 @@ class MultiAgentSystem:
         🎯 LEMBRE-SE: Se o roteiro atual tem menos de {min_words} palavras, você DEVE expandi-lo completamente. NÃO aceite roteiros curtos!
         """
         
-        response = self.llm.invoke([HumanMessage(content=prompt)])
+        response = await self._call_llm(prompt, "revisor", stream=True)
+        
+        # Em vez de pedir para o modelo refazer tudo, corrige só as seções fora do orçamento
+        final_script = self.length_controller.strip_preamble(response.content)
+        if not self.length_controller.within_window(final_script, target_minutes):
+            final_script = await self.length_controller.adjust(
+                final_script, target_minutes, lambda section: self._regenerate_section(section, state)
+            )
+        if not self.length_controller.within_window(final_script, target_minutes):
+            # Não há mais o que tentar sem outra reescrita completa; registra em vez de esconder
+            _, final_words = script_utils.extract_spoken_words(final_script)
+            print(f"Warning: Roteiro final com {final_words} palavras, fora da faixa {min_words}-{max_words}")
+            metrics.increment("revisor.off_window")
+        
+        return self._final_script_update(final_script)
+    
+    def _final_script_update(self, script: str) -> Dict:
+        """Monta o roteiro final com o cabeçalho de tempo recalculado localmente"""
+        _, word_count = ScriptUtils.extract_spoken_words(script)
+        final_script = f"{ScriptUtils.format_duration_header(word_count)}\n\n{script.strip()}"
+        return {"final_script": final_script, "messages": [AIMessage(content=final_script)]}
+    
+    async def _regenerate_section(self, section: Dict, state: ScriptState) -> str:
+        """Reescreve uma única seção do roteiro para caber no seu orçamento de palavras"""
+        personality_prompt = state.get("personality_prompt", "")
+        style = f"Siga este estilo: {personality_prompt}" if personality_prompt else "Mantenha o tom do Eliseu: didático, coloquial e próximo do espectador."
         
-        # Verifica se o resultado ainda está curto e tenta uma segunda vez
-        new_spoken_text, new_word_count = script_utils.extract_spoken_words(response.content)
+        prompt = f"""
+        Reescreva APENAS a seção abaixo de um roteiro de YouTube sobre "{state['topic']}".
         
-        if new_word_count < min_words:
-            # Segunda tentativa com prompt ainda mais agressivo
-            retry_prompt = f"""
-            🚨🚨 SEGUNDA TENTATIVA - ROTEIRO AINDA MUITO CURTO! 🚨🚨
-            
-            Você retornou {new_word_count} palavras quando o mínimo é {min_words} palavras!
-            
-            ISSO É INACEITÁVEL! Você DEVE gerar pelo menos {min_words} palavras FALADAS.
-            
-            Pegue o roteiro abaixo e TRIPLIQUE o conteúdo:
-            {response.content}
-            
-            🚨 FORMATO OBRIGATÓRIO - SIGA RIGOROSAMENTE:
-            
-            [GANCHO - 10 segundos]
-            Eliseu 👤: [Fala de abertura aqui...]
-            
-            [INTRODUÇÃO - contexto]
-            Eliseu 👤: [Explicação do contexto...]
-            
-            [DESENVOLVIMENTO - pontos principais]
-            Eliseu 👤: [Primeiro ponto expandido...]
-            
-            [INDICAÇÃO VISUAL - mostrar dados]
-            Eliseu 👤: [Comentário sobre o visual...]
-            
-            [CONCLUSÃO - call to action]
-            Eliseu 👤: [Finalização e CTA...]
-            
-            ESTRATÉGIAS OBRIGATÓRIAS:
-            - Para CADA ponto, adicione 3-5 frases de explicação
-            - Para CADA exemplo, adicione histórias e contexto
-            - Adicione sub-tópicos em CADA seção
-            - Desenvolva MUITO mais a introdução e conclusão
-            - Use o formato [SEÇÃO] e "Eliseu 👤:" OBRIGATORIAMENTE
-            
-            🚫 REGRAS CRÍTICAS:
-            ❌ PROIBIDO texto corrido sem formatação
-            ❌ PROIBIDO omitir "Eliseu 👤:" antes de falas
-            ❌ PROIBIDO omitir seções [ENTRE COLCHETES]
-            ❌ PROIBIDO comentários finais sobre o roteiro
-            
-            ✅ USE o formato especificado acima OBRIGATORIAMENTE
-            ✅ TERMINE com última fala do Eliseu
-            ✅ PELO MENOS {min_words} PALAVRAS FALADAS!
-            """
-            
-            retry_response = self.llm.invoke([HumanMessage(content=retry_prompt)])
-            response = retry_response
+        ALVO: ~{section['goal']} palavras FALADAS (hoje tem {section['words']}).
+        {style}
+        
+        REGRAS:
+        - Mantenha o marcador [{section['title']}] na primeira linha
+        - Toda fala começa com "Eliseu 👤:"
+        - Indicações técnicas sempre [entre colchetes]
+        - Desenvolva a mesma ideia com exemplos e detalhes; não invente outras seções
+        - Responda só com a seção, sem comentários
+        
+        SEÇÃO ATUAL:
+        {section['text']}
+        """
         
-        state["final_script"] = response.content
-        state["messages"].append(response)
-        return state
+        response = await self._call_llm(prompt, "revisor", call_type="section_fix")
+        return response.content
     
     def _format_videos(self, videos: List[Dict]) -> str:
         formatted = []
@@ -698,10 +1251,10 @@ class MultiAgentSystem:
             
             # Adiciona transcrição se disponível
             if video.get('has_transcript', False):
-                transcript_preview = video.get('transcript_summary', '')[:300]
+                transcript_preview = self.token_budget.counter.truncate(video.get('transcript_summary', ''), 80)
                 video_info += f"""
             - ✅ TRANSCRIÇÃO DISPONÍVEL
-            - Prévia do conteúdo: "{transcript_preview}..." """
+            - Prévia do conteúdo: "{transcript_preview}" """
             else:
                 video_info += f"""
             - ❌ Sem transcrição disponível"""
@@ -709,7 +1262,24 @@ class MultiAgentSystem:
             formatted.append(video_info)
         return '\n'.join(formatted)
     
-    async def generate_script(self, videos: List[Dict], topic: str, target_minutes: int = 10, personality_prompt: str = None, model_provider: str = None) -> str:
+    async def generate_script(self, videos: List[Dict], topic: str, target_minutes: int = 10, personality_prompt: str = None, model_provider: str = None,
+                              progress_callback: Optional[Callable[[Dict], None]] = None, stream_tokens: bool = False,
+                              bypass_llm_cache: bool = False, drafting_mode: Optional[str] = None,
+                              generation_id: Optional[str] = None, owner_id: Optional[str] = None) -> str:
+        """
+        Executa o pipeline multiagente e retorna o roteiro final
+        
+        Args:
+            progress_callback: Recebe um evento por início/fim de cada nó do grafo
+                (os nós são assíncronos, então é chamado na thread do event loop)
+            stream_tokens: Se True, também envia ao progress_callback os tokens
+                gerados pelos estágios finais (eliseu e revisor)
+            bypass_llm_cache: Se True, ignora o cache de respostas do LLM nesta geração
+            drafting_mode: "single", "sections" ou "auto"; None usa SCRIPT_DRAFTING_MODE
+            generation_id: Se informado, o estado é salvo após cada nó e a geração
+                pode ser retomada com resume_script se algum estágio falhar
+            owner_id: Usuário dono da geração, gravado junto do checkpoint
+        """
         if not self.llm:
             provider_name = model_provider or self.model_provider
             return f"Error: {provider_name.upper()} API não está disponível. Por favor configure as chaves de API."
@@ -718,14 +1288,206 @@ class MultiAgentSystem:
             videos=videos,
             topic=topic,
             target_minutes=target_minutes,
-            personality_prompt=personality_prompt or "",
+            personality_prompt=self.token_budget.cap_personality(personality_prompt),
             model_provider=model_provider or self.model_provider,
             trends=[],
             script_structure={},
             raw_script="",
             final_script="",
-            messages=[]
+            messages=[],
+            resume_from=""
+        )
+        
+        generation = GenerationContext(
+            progress_callback=progress_callback,
+            stream_tokens=stream_tokens,
+            bypass_llm_cache=bypass_llm_cache,
+            drafting_mode=drafting_mode,
+            generation_id=generation_id,
+            owner_id=owner_id
+        )
+        return await self._run_graph(initial_state, generation)
+    
+    async def resume_script(self, checkpoint: Dict, progress_callback: Optional[Callable[[Dict], None]] = None,
+                            stream_tokens: bool = False, bypass_llm_cache: bool = False) -> str:
+        """
+        Retoma uma geração a partir do último nó concluído no checkpoint
+        
+        Args:
+            checkpoint: Retorno de CheckpointStore.load
+            progress_callback, stream_tokens, bypass_llm_cache: Como em generate_script
+        
+        Returns:
+            O roteiro final (direto do checkpoint se a geração já tinha terminado)
+        """
+        state = checkpoint["state"]
+        last_node = checkpoint["last_node"]
+        if last_node == self.NODE_ORDER[-1]:
+            return state["final_script"]
+        
+        if not self.llm:
+            return f"Error: {self.model_provider.upper()} API não está disponível. Por favor configure as chaves de API."
+        
+        next_node = self.NODE_ORDER[self.NODE_ORDER.index(last_node) + 1]
+        print(f"DEBUG: Retomando geração {checkpoint['generation_id']} a partir de {next_node}")
+        metrics.increment("checkpoint.resumed")
+        metrics.increment("checkpoint.nodes_skipped", self.NODE_ORDER.index(next_node))
+        
+        generation = GenerationContext(
+            progress_callback=progress_callback,
+            stream_tokens=stream_tokens,
+            bypass_llm_cache=bypass_llm_cache,
+            generation_id=checkpoint["generation_id"],
+            owner_id=checkpoint.get("owner_id")
+        )
+        return await self._run_graph(ScriptState(**state, resume_from=next_node), generation)
+    
+    async def regenerate_script(self, checkpoint: Dict, changes: Dict, generation_id: Optional[str] = None,
+                                owner_id: Optional[str] = None, progress_callback: Optional[Callable[[Dict], None]] = None,
+                                stream_tokens: bool = False, bypass_llm_cache: bool = False) -> str:
+        """
+        Refaz só os nós afetados pelas entradas alteradas, reaproveitando a saída dos anteriores
+        
+        Mudar o estilo reexecuta eliseu e revisor; mudar a duração reexecuta a
+        partir do roteirista. Pesquisador e analista nunca rodam de novo.
+        
+        Args:
+            checkpoint: Retorno de CheckpointStore.load de uma geração anterior
+            changes: Novos valores de personality_prompt e/ou target_minutes
+            generation_id: Id da nova geração (a anterior fica intacta)
+            owner_id, progress_callback, stream_tokens, bypass_llm_cache: Como em generate_script
+        
+        Returns:
+            O novo roteiro final
+        
+        Raises:
+            RegenerationConflict: Se o checkpoint ainda não tem as saídas que seriam reaproveitadas
+        """
+        previous_state = checkpoint["state"]
+        # O estado guarda o estilo já limitado pelo orçamento: compara na mesma forma
+        changes = dict(changes)
+        if changes.get("personality_prompt") is not None:
+            changes["personality_prompt"] = self.token_budget.cap_personality(changes["personality_prompt"])
+        changed = {
+            key: value for key, value in changes.items()
+            if key in self.REGENERATION_ENTRY and value is not None and value != previous_state.get(key)
+        }
+        if not changed and checkpoint["last_node"] == self.NODE_ORDER[-1]:
+            return previous_state["final_script"]
+        
+        if not self.llm:
+            return f"Error: {self.model_provider.upper()} API não está disponível. Por favor configure as chaves de API."
+        
+        entry_node = min(
+            (self.REGENERATION_ENTRY[key] for key in changed),
+            key=self.NODE_ORDER.index,
+            default=self.NODE_ORDER[-1]
         )
+        entry_index = self.NODE_ORDER.index(entry_node)
+        if self.NODE_ORDER.index(checkpoint["last_node"]) < entry_index - 1:
+            raise RegenerationConflict(f"A geração anterior não chegou até {self.NODE_ORDER[entry_index - 1]}; retome-a em vez de regenerar.")
+        
+        # Cada nó acrescenta uma mensagem, então as primeiras entry_index são as saídas reaproveitadas
+        state = {**previous_state, **changed, "final_script": ""}
+        state["messages"] = list(previous_state["messages"])[:entry_index]
+        print(f"DEBUG: Regeneração parcial a partir de {entry_node} (alterado: {', '.join(changed) or 'nada'})")
+        metrics.increment("regeneration.partial")
+        metrics.increment("regeneration.nodes_skipped", entry_index)
+        
+        generation = GenerationContext(
+            progress_callback=progress_callback,
+            stream_tokens=stream_tokens,
+            bypass_llm_cache=bypass_llm_cache,
+            generation_id=generation_id,
+            owner_id=owner_id
+        )
+        return await self._run_graph(ScriptState(**state, resume_from=entry_node), generation)
+    
+    async def _run_graph(self, initial_state: ScriptState, generation: GenerationContext) -> str:
+        token = _generation.set(generation)
+        try:
+            result = await self.graph.ainvoke(initial_state)
+        except asyncio.CancelledError:
+            # Cliente foi embora: a chamada ao provider em andamento já foi cancelada junto
+            self._record_cancellation(generation)
+            await self._mark_checkpoint_failed(generation, "cancelada")
+            raise
+        except Exception as e:
+            await self._mark_checkpoint_failed(generation, str(e))
+            raise
+        finally:
+            _generation.reset(token)
+        
+        metrics.increment("generation.completed")
+        metrics.increment("generation.output_tokens", generation.output_tokens)
+        metrics.increment("generation.seconds", time.monotonic() - generation.started_at)
+        return result["final_script"]
+    
+    async def _mark_checkpoint_failed(self, generation: GenerationContext, error: str) -> None:
+        if not generation.generation_id:
+            return
+        try:
+            await asyncio.to_thread(self.checkpoints.mark_failed, generation.generation_id, error)
+        except Exception as checkpoint_error:
+            print(f"Erro ao marcar checkpoint como falho: {str(checkpoint_error)}")
+    
+    def _record_cancellation(self, generation: GenerationContext) -> None:
+        """
+        Estima o que a geração cancelada ainda teria gasto, pela média das gerações concluídas
+        """
+        elapsed = time.monotonic() - generation.started_at
+        completed = metrics.get("generation.completed")
+        saved_tokens = 0
+        saved_seconds = 0.0
+        if completed:
+            saved_tokens = max(0, metrics.get("generation.output_tokens") / completed - generation.output_tokens)
+            saved_seconds = max(0.0, metrics.get("generation.seconds") / completed - elapsed)
+        
+        metrics.increment("cancellation.count")
+        metrics.increment("cancellation.saved_output_tokens", round(saved_tokens))
+        metrics.increment("cancellation.saved_seconds", round(saved_seconds, 1))
+        print(f"DEBUG: Geração cancelada após {elapsed:.1f}s (~{saved_tokens:.0f} tokens e ~{saved_seconds:.0f}s economizados)")
+
+class AgentSystemRegistry:
+    """
+    Mantém um MultiAgentSystem de longa duração por provider
+    
+    Cada instância guarda o cliente do LLM (com seu pool de conexões HTTP) e o
+    grafo já compilado. Todo estado de uma geração vive no ScriptState e no
+    contexto da chamada, então a mesma instância atende requisições concorrentes.
+    """
+    
+    SUPPORTED_PROVIDERS = ["gpt-4.1", "gpt-5", "claude-sonnet-4", "claude-opus-4.1"]
+    DEFAULT_PROVIDER = "gpt-4.1"
+    
+    def __init__(self):
+        self._systems: Dict[str, MultiAgentSystem] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, model_provider: Optional[str] = None) -> MultiAgentSystem:
+        """
+        Retorna o sistema do provider, criando-o na primeira vez
         
-        result = await self.graph.ainvoke(initial_state)
-        return result["final_script"]
\ No newline at end of file
+        Args:
+            model_provider: Nome do provider; desconhecidos caem no padrão
+        """
+        model_provider = model_provider or self.DEFAULT_PROVIDER
+        if model_provider not in self.SUPPORTED_PROVIDERS:
+            print(f"Warning: Provider '{model_provider}' desconhecido. Usando {self.DEFAULT_PROVIDER}.")
+            model_provider = self.DEFAULT_PROVIDER
+        
+        system = self._systems.get(model_provider)
+        if system is not None:
+            return system
+        
+        with self._lock:
+            system = self._systems.get(model_provider)
+            if system is None:
+                system = MultiAgentSystem(model_provider=model_provider)
+                self._systems[model_provider] = system
+        return system
+    
+    def providers(self) -> List[str]:
+        return list(self._systems.keys())
+
+agent_registry = AgentSystemRegistry()
\ No newline at end of file
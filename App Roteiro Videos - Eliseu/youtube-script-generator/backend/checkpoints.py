@@ -0,0 +1,138 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+from langchain.schema import AIMessage
+from disk_cache import DiskCache
+
+class CheckpointConflict(Exception):
+    """O generation_id já pertence a outro usuário"""
+
+class CheckpointStore:
+    """
+    Guarda o ScriptState depois de cada nó do grafo, por generation_id
+
+    Se um estágio falha (timeout, 5xx do provider), a geração pode ser retomada
+    do último nó concluído em vez de refazer as chamadas que já deram certo.
+    Usa DiskCache, então os checkpoints valem para todos os workers da máquina.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv("CHECKPOINT_TTL", "86400"))
+        # Checkpoint "running" sem atualização há mais que isso = processo morreu no meio
+        self.stale_after = float(os.getenv("CHECKPOINT_STALE_AFTER", "600"))
+        self.cache = self._open_cache()
+
+    def _open_cache(self) -> Optional[DiskCache]:
+        cache_path = os.getenv("CHECKPOINT_PATH", ".cache/checkpoints.sqlite3")
+        if not cache_path:
+            return None
+        try:
+            max_bytes = int(os.getenv("CHECKPOINT_MAX_MB", "64")) * 1024 * 1024
+            return DiskCache(cache_path, max_bytes=max_bytes)
+        except Exception as e:
+            print(f"Warning: Armazenamento de checkpoints indisponível ({str(e)}). Gerações não poderão ser retomadas.")
+            return None
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache is not None
+
+    def save(self, generation_id: str, state: Dict, last_node: str, status: str = "running",
+             owner_id: Optional[str] = None) -> None:
+        """
+        Grava o estado acumulado após um nó
+
+        Args:
+            generation_id: Identificador da geração
+            state: ScriptState completo após o nó (mensagens viram só o texto)
+            last_node: Último nó concluído
+            status: "running", "completed" ou "failed"
+            owner_id: Usuário dono da geração (checado ao retomar)
+
+        Raises:
+            CheckpointConflict: Já existe checkpoint desse id de outro usuário
+        """
+        if not self.cache:
+            return
+
+        existing = self._read(generation_id)
+        if existing is not None and existing.get("owner_id") != owner_id:
+            raise CheckpointConflict(f"Geração {generation_id} pertence a outro usuário")
+
+        serializable = {key: value for key, value in state.items() if key not in ("messages", "resume_from")}
+        serializable["messages"] = [message.content for message in state.get("messages", [])]
+        checkpoint = {
+            "generation_id": generation_id,
+            "last_node": last_node,
+            "status": status,
+            "owner_id": owner_id,
+            "error": None,
+            "updated_at": time.time(),
+            "state": serializable
+        }
+        self.cache.set(self._key(generation_id), json.dumps(checkpoint).encode("utf-8"), ttl=self.ttl)
+
+    def claim(self, generation_id: str) -> bool:
+        """
+        Passa a geração para "running" se ela puder ser retomada, de forma atômica
+
+        Returns:
+            False se o checkpoint não existe ou não está retomável (ex.: outro
+            resume acabou de pegá-lo)
+        """
+        def change(raw: bytes) -> Optional[bytes]:
+            checkpoint = json.loads(raw)
+            if not self.is_resumable(checkpoint):
+                return None
+            return self._with_status(checkpoint, "running", None)
+
+        return bool(self.cache) and self.cache.update(self._key(generation_id), change, ttl=self.ttl)
+
+    def mark_failed(self, generation_id: str, error: str) -> None:
+        """Marca a geração como interrompida, mantendo o último estado salvo"""
+        if not self.cache:
+            return
+        self.cache.update(
+            self._key(generation_id),
+            lambda raw: self._with_status(json.loads(raw), "failed", error),
+            ttl=self.ttl
+        )
+
+    @staticmethod
+    def _with_status(checkpoint: Dict, status: str, error: Optional[str]) -> bytes:
+        checkpoint["status"] = status
+        checkpoint["error"] = error
+        checkpoint["updated_at"] = time.time()
+        return json.dumps(checkpoint).encode("utf-8")
+
+    def load(self, generation_id: str) -> Optional[Dict]:
+        """
+        Busca o checkpoint de uma geração
+
+        Returns:
+            O checkpoint com o estado pronto para o grafo (mensagens como AIMessage)
+            ou None se não existir / expirou
+        """
+        checkpoint = self._read(generation_id)
+        if checkpoint is None:
+            return None
+        checkpoint["state"]["messages"] = [AIMessage(content=content) for content in checkpoint["state"]["messages"]]
+        return checkpoint
+
+    def is_resumable(self, checkpoint: Dict) -> bool:
+        if checkpoint["status"] == "failed":
+            return True
+        return checkpoint["status"] == "running" and time.time() - checkpoint["updated_at"] > self.stale_after
+
+    def _read(self, generation_id: str) -> Optional[Dict]:
+        if not self.cache:
+            return None
+        raw = self.cache.get(self._key(generation_id))
+        return json.loads(raw) if raw is not None else None
+
+    @staticmethod
+    def _key(generation_id: str) -> str:
+        return f"checkpoint:{generation_id}"
+
+checkpoint_store = CheckpointStore()
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, Optional, Dict
+
+class DiskCache:
+    """
+    Cache persistente em SQLite com valores comprimidos (zlib)
+
+    O arquivo sobrevive a reinícios e pode ser compartilhado por todos os
+    workers do uvicorn na mesma máquina (modo WAL). O tamanho total é limitado
+    por max_bytes com despejo LRU, e cada entrada pode ter seu próprio TTL.
+    """
+
+    def __init__(self, path: str, max_bytes: int, compress_level: int = 6):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3.Connection não pode ser compartilhada entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_compressed(self, key: str) -> Optional[bytes]:
+        """
+        Retorna o valor ainda comprimido (útil para descomprimir em streaming)
+
+        Args:
+            key: Chave da entrada
+
+        Returns:
+            Bytes comprimidos ou None se não existir / estiver expirado
+        """
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self._count(hit=False)
+            return None
+
+        value, expires_at = row
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(hit=False)
+            return None
+
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Busca uma entrada do cache
+
+        Args:
+            key: Chave da entrada
+
+        Returns:
+            Valor descomprimido ou None se não existir / estiver expirado
+        """
+        value = self.get_compressed(key)
+        if value is None:
+            return None
+        return zlib.decompress(value)
+
+    @staticmethod
+    def iter_decompressed(compressed: bytes, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Descomprime um valor em pedaços de até chunk_size bytes, sem materializar tudo na memória
+
+        Args:
+            compressed: Valor retornado por get_compressed
+            chunk_size: Tamanho máximo de cada pedaço
+        """
+        decompressor = zlib.decompressobj()
+        data = compressed
+        while data:
+            chunk = decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+            if chunk:
+                yield chunk
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """
+        Grava uma entrada e despeja as menos usadas se o limite de tamanho estourar
+
+        Args:
+            key: Chave da entrada
+            value: Valor em bytes (será comprimido)
+            ttl: Tempo de vida em segundos (None = sem expiração)
+        """
+        now = time.time()
+        compressed = zlib.compress(value, self.compress_level)
+        expires_at = now + ttl if ttl is not None else None
+
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, compressed, len(compressed), expires_at, now)
+        )
+        self._evict(conn, now)
+
+    def update(self, key: str, change: Callable[[bytes], Optional[bytes]], ttl: Optional[float] = None) -> bool:
+        """
+        Lê, transforma e regrava uma entrada numa única transação
+
+        A transação pega o lock de escrita do SQLite antes de ler, então dois
+        processos não conseguem aplicar a mesma transição ao mesmo tempo
+        (compare-and-swap).
+
+        Args:
+            key: Chave da entrada
+            change: Recebe o valor atual e devolve o novo, ou None para não mudar nada
+            ttl: Tempo de vida do novo valor em segundos (None = sem expiração)
+
+        Returns:
+            True se a entrada existia, não tinha expirado e foi regravada
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            value = change(zlib.decompress(row[0])) if row is not None else None
+            if value is not None:
+                compressed = zlib.compress(value, self.compress_level)
+                conn.execute(
+                    "UPDATE entries SET value = ?, size = ?, expires_at = ?, last_access = ? WHERE key = ?",
+                    (compressed, len(compressed), now + ttl if ttl is not None else None, now, key)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value is not None
+
+    def contains(self, key: str) -> bool:
+        """Diz se a entrada existe e não expirou, sem ler o valor nem atualizar o LRU"""
+        row = self._connection().execute(
+            "SELECT 1 FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Remove entradas expiradas e, se necessário, as menos usadas até ~90% do limite"""
+        conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall()
+            for key, size in rows:
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict:
+        conn = self._connection()
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from metrics import metrics
+
+class LatencyTracker:
+    """Janela das últimas latências observadas por chave (ex.: nó + tipo de chamada)"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, percentile: float) -> Tuple[Optional[float], int]:
+        """
+        Returns:
+            Tupla (latência no percentil, número de amostras); latência None sem amostras
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None, 0
+        index = min(len(samples) - 1, max(0, math.ceil(percentile / 100 * len(samples)) - 1))
+        return samples[index], len(samples)
+
+class HedgePolicy:
+    """
+    Quando disparar a chamada de reserva para cada nó do grafo
+
+    A espera antes do hedge é o percentil configurado da latência do provider
+    principal naquele nó; até juntar amostras suficientes usa um valor fixo.
+    Desligado quando LLM_HEDGE_PROVIDER não está configurado.
+    """
+
+    def __init__(self):
+        self.provider = os.getenv("LLM_HEDGE_PROVIDER", "")
+        nodes = os.getenv("LLM_HEDGE_NODES", "pesquisador,analista,roteirista,eliseu,revisor")
+        self.nodes = {node.strip() for node in nodes.split(",") if node.strip()}
+        self.percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.default_delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "20"))
+        self.latencies = LatencyTracker()
+
+    def delay_for(self, key: str, agent_name: str) -> Optional[float]:
+        """
+        Args:
+            key: Chave de latência (nó + tipo de chamada)
+            agent_name: Nó do grafo
+
+        Returns:
+            Segundos de espera antes do hedge, ou None se o nó não usa hedge
+        """
+        if not self.provider or agent_name not in self.nodes:
+            return None
+        latency, samples = self.latencies.percentile(key, self.percentile)
+        if samples < self.min_samples:
+            return self.default_delay
+        return latency
+
+async def hedged(primary: Callable[[], Awaitable[Any]], secondary: Callable[[], Awaitable[Any]],
+                 delay: float, label: str,
+                 discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Tuple[Any, str, float]:
+    """
+    Executa primary e, se não terminar em delay segundos (ou falhar), dispara
+    secondary; fica com o primeiro que terminar com sucesso e cancela o outro
+
+    Args:
+        primary: Fábrica da coroutine no provider principal
+        secondary: Fábrica da coroutine no provider de reserva
+        delay: Espera antes do hedge
+        label: Nome usado nos logs
+        discard: Libera o resultado de uma tentativa que terminou mas perdeu
+            (ex.: fecha o stream); tentativas canceladas liberam o próprio recurso
+
+    Returns:
+        Tupla (resultado, "primary" ou "secondary", segundos até o resultado do primary
+        ou até ele ser abandonado)
+
+    Raises:
+        A exceção do primary se os dois falharem
+    """
+    started_at = time.monotonic()
+    primary_task = asyncio.create_task(primary())
+    secondary_task = None
+    winner_task = None
+
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if primary_task in done:
+            if primary_task.exception() is None:
+                winner_task = primary_task
+                return primary_task.result(), "primary", time.monotonic() - started_at
+            # Falhou antes do prazo: a reserva vira fallback
+            print(f"Warning: Provider principal falhou em {label} ({str(primary_task.exception())}). Usando o de reserva.")
+            metrics.increment("hedge.fallback")
+        else:
+            print(f"DEBUG: Hedge {label}: principal passou de {delay:.1f}s, disparando o de reserva")
+            metrics.increment("hedge.issued")
+
+        secondary_task = asyncio.create_task(secondary())
+        pending = {task for task in (primary_task, secondary_task) if not task.done()}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Se os dois terminaram juntos, fica com o principal
+            for task in sorted(done, key=lambda task: task is not primary_task):
+                if task.exception() is None:
+                    winner_task = task
+                    winner = "primary" if task is primary_task else "secondary"
+                    return task.result(), winner, time.monotonic() - started_at
+                if task is secondary_task:
+                    print(f"Warning: Provider de reserva falhou em {label} ({str(task.exception())}).")
+
+        raise primary_task.exception()
+    finally:
+        for task in (primary_task, secondary_task):
+            if task is None or task is winner_task:
+                continue
+            if not task.done():
+                task.cancel()
+            elif discard and not task.cancelled() and task.exception() is None:
+                try:
+                    await discard(task.result())
+                except Exception as e:
+                    print(f"Warning: Falha ao liberar a tentativa perdedora em {label} ({str(e)}).")
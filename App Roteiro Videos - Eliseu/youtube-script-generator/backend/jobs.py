@@ -0,0 +1,385 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+from metrics import metrics
+
+class JobStore:
+    """
+    Estado persistente dos jobs de geração em SQLite
+
+    Guarda o pedido, o status e o resultado de cada job, então um cliente pode
+    consultar o job mesmo depois de a conexão que o criou ter caído, e jobs
+    interrompidos por um reinício do processo podem ser reenfileirados. O
+    processo que tem o job na sua fila ou em execução renova heartbeat_at
+    periodicamente; job sem heartbeat recente ficou órfão.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                owner_id TEXT,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                generation_id TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            )
+        """)
+        self._connection().execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+        columns = {row["name"] for row in self._connection().execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            # Banco criado antes do heartbeat
+            self._connection().execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3.Connection não pode ser compartilhada entre threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id: str, owner_id: Optional[str], payload: Dict, generation_id: str) -> None:
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (job_id, owner_id, status, payload, generation_id, created_at, heartbeat_at) VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, owner_id, json.dumps(payload), generation_id, now, now)
+        )
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Marca o job como em execução se ainda estiver na fila
+
+        Returns:
+            False se outro worker (ou outro processo do uvicorn) já pegou o job
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE job_id = ? AND status = 'queued'",
+            (now, now, job_id)
+        )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """Renova o heartbeat dos jobs que este processo tem na fila ou em execução"""
+        if not job_ids:
+            return
+        placeholders = ",".join("?" for _ in job_ids)
+        self._connection().execute(
+            f"UPDATE jobs SET heartbeat_at = ? WHERE status IN ('queued', 'running') AND job_id IN ({placeholders})",
+            (time.time(), *job_ids)
+        )
+
+    def release(self, job_id: str) -> None:
+        """Devolve à fila um job que estava em execução (ex.: desligamento do processo)"""
+        self._connection().execute(
+            "UPDATE jobs SET status = 'queued' WHERE job_id = ? AND status = 'running'", (job_id,)
+        )
+
+    def mark_finished(self, job_id: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        status = "failed" if error is not None else "completed"
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (status, result, error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def requeue_stale(self, stale_after: float) -> List[str]:
+        """
+        Devolve à fila jobs "running" sem heartbeat há mais de stale_after segundos
+        (o processo que os executava morreu sem terminá-los)
+
+        Returns:
+            IDs que este chamador devolveu à fila (outro processo pode ter pego alguns antes)
+        """
+        cutoff = time.time() - stale_after
+        rows = self._connection().execute(
+            "SELECT job_id FROM jobs WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+            (cutoff,)
+        ).fetchall()
+        requeued = []
+        for row in rows:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET status = 'queued' WHERE job_id = ? AND status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+                (row["job_id"], cutoff)
+            )
+            if cursor.rowcount == 1:
+                requeued.append(row["job_id"])
+        return requeued
+
+    def adopt_stale_queued(self, stale_after: float) -> List[str]:
+        """
+        Assume jobs "queued" sem heartbeat há mais de stale_after segundos
+        (estavam na fila em memória de um processo que morreu)
+
+        Returns:
+            IDs assumidos por este chamador
+        """
+        now = time.time()
+        cutoff = now - stale_after
+        rows = self._connection().execute(
+            "SELECT job_id FROM jobs WHERE status = 'queued' AND COALESCE(heartbeat_at, created_at) < ?",
+            (cutoff,)
+        ).fetchall()
+        adopted = []
+        for row in rows:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND status = 'queued' AND COALESCE(heartbeat_at, created_at) < ?",
+                (now, row["job_id"], cutoff)
+            )
+            if cursor.rowcount == 1:
+                adopted.append(row["job_id"])
+        return adopted
+
+    def queued(self) -> List[str]:
+        """IDs dos jobs na fila, do mais antigo ao mais novo"""
+        rows = self._connection().execute(
+            "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def count_active(self, owner_id: Optional[str]) -> int:
+        """Jobs do usuário na fila ou rodando"""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE owner_id IS ? AND status IN ('queued', 'running')", (owner_id,)
+        ).fetchone()[0]
+
+    def purge(self, older_than: float) -> int:
+        """Remove jobs terminados há mais de older_than segundos"""
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+            (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+class JobQueue:
+    """
+    Fila de jobs de geração executada por um número fixo de workers asyncio
+
+    A geração deixa de viver dentro da requisição HTTP: o envio devolve um
+    job_id na hora e o trabalho continua mesmo se o cliente desconectar. O
+    número de workers limita quantas gerações rodam ao mesmo tempo; o
+    excedente espera na fila. Os eventos de progresso ficam em memória
+    enquanto o job roda, para que clientes possam se conectar (ou reconectar)
+    ao SSE a qualquer momento e receber o histórico.
+    """
+
+    def __init__(self, store: JobStore, runner: Callable[[Dict, Callable[[Dict], None]], Awaitable[str]],
+                 workers: int = 4, retention: float = 604800, stale_after: float = 120,
+                 sweep_interval: float = 30):
+        """
+        Args:
+            store: Persistência dos jobs
+            runner: Coroutine que executa o job (recebe o job e um progress_callback) e devolve o roteiro
+            workers: Número máximo de gerações simultâneas
+            retention: Por quanto tempo (segundos) manter jobs terminados
+            stale_after: Após quantos segundos sem heartbeat um job "running" é considerado órfão
+                (deve ser bem maior que sweep_interval)
+            sweep_interval: De quanto em quanto tempo renovar o heartbeat e procurar jobs órfãos
+        """
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.retention = retention
+        self.stale_after = stale_after
+        self.sweep_interval = sweep_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._history: Dict[str, List[Dict]] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self.running = 0
+
+    async def start(self) -> None:
+        """Sobe os workers e reenfileira os jobs que o processo anterior não terminou"""
+        self._queue = asyncio.Queue()
+        purged = await asyncio.to_thread(self.store.purge, self.retention)
+        if purged:
+            print(f"DEBUG: {purged} jobs antigos removidos")
+
+        await self._requeue_stale()
+        for job_id in await asyncio.to_thread(self.store.queued):
+            self._enqueue(job_id)
+
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sweeper_task = asyncio.create_task(self._sweeper())
+
+    async def stop(self) -> None:
+        tasks = self._worker_tasks + ([self._sweeper_task] if self._sweeper_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._sweeper_task = None
+
+    def is_tracking(self, job_id: str) -> bool:
+        """Se o job está na fila ou rodando neste processo"""
+        return job_id in self._history
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id in self._history:
+            return
+        self._history[job_id] = []
+        self._queue.put_nowait(job_id)
+
+    async def _requeue_stale(self) -> None:
+        requeued = await asyncio.to_thread(self.store.requeue_stale, self.stale_after)
+        requeued += await asyncio.to_thread(self.store.adopt_stale_queued, self.stale_after)
+        if requeued:
+            print(f"DEBUG: {len(requeued)} jobs órfãos voltaram para a fila")
+            metrics.increment("jobs.requeued", len(requeued))
+        for job_id in requeued:
+            self._enqueue(job_id)
+
+    async def _sweeper(self) -> None:
+        # Não basta checar no start: um restart rápido após um crash deixa jobs
+        # com heartbeat recente, que só ficam órfãos minutos depois
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._history))
+                await self._requeue_stale()
+            except Exception as e:
+                print(f"Erro na varredura de jobs órfãos: {str(e)}")
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, payload: Dict, owner_id: Optional[str] = None) -> Dict:
+        """
+        Persiste e enfileira um job
+
+        Args:
+            payload: Parâmetros da geração (serializáveis em JSON)
+            owner_id: Usuário dono do job
+
+        Returns:
+            O job recém-criado
+        """
+        job_id = uuid.uuid4().hex
+        # Sempre gerado aqui: um id vindo do cliente poderia retomar o checkpoint de outra geração
+        generation_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create, job_id, owner_id, payload, generation_id)
+        self._enqueue(job_id)
+        metrics.increment("jobs.submitted")
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def subscribe(self, job_id: str) -> Optional[asyncio.Queue]:
+        """
+        Assina os eventos de um job em andamento
+
+        Returns:
+            Fila já contendo os eventos anteriores, ou None se o job não está ativo neste processo
+        """
+        history = self._history.get(job_id)
+        if history is None:
+            return None
+        events = asyncio.Queue()
+        for event in history:
+            events.put_nowait(event)
+        self._subscribers.setdefault(job_id, []).append(events)
+        return events
+
+    def unsubscribe(self, job_id: str, events: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id, [])
+        if events in subscribers:
+            subscribers.remove(events)
+        if not subscribers:
+            self._subscribers.pop(job_id, None)
+
+    def _publish(self, job_id: str, event: Dict) -> None:
+        # Tokens só vão para quem está conectado; o histórico guarda o resto para quem chegar depois
+        if event.get("type") != "token":
+            self._history.setdefault(job_id, []).append(event)
+        for events in self._subscribers.get(job_id, []):
+            events.put_nowait(event)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        if not await asyncio.to_thread(self.store.claim, job_id):
+            self._history.pop(job_id, None)
+            return
+        job = await asyncio.to_thread(self.store.get, job_id)
+
+        self.running += 1
+        self._publish(job_id, {"type": "job", "status": "running", "job_id": job_id})
+        try:
+            script = await self.runner(job, lambda event: self._publish(job_id, event))
+        except asyncio.CancelledError:
+            # Desligamento: o job volta para a fila e retoma do checkpoint no próximo start
+            self.store.release(job_id)
+            raise
+        except Exception as e:
+            print(f"Erro ao executar job {job_id}: {str(e)}")
+            await asyncio.to_thread(self.store.mark_finished, job_id, None, str(e))
+            metrics.increment("jobs.failed")
+            self._publish(job_id, {"type": "error", "error": str(e), "job_id": job_id, "generation_id": job["generation_id"]})
+        else:
+            await asyncio.to_thread(self.store.mark_finished, job_id, script)
+            metrics.increment("jobs.completed")
+            self._publish(job_id, {
+                "type": "done", "step": 5, "total": 5, "agent": "🎉 Concluído", "description": "Roteiro pronto!",
+                "percentage": 100, "script": script, "job_id": job_id, "generation_id": job["generation_id"]
+            })
+        finally:
+            self.running -= 1
+            # Quem chegar depois lê o resultado do banco
+            self._history.pop(job_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.pending
+        }
+
+def create_job_queue(runner: Callable[[Dict, Callable[[Dict], None]], Awaitable[str]]) -> Optional[JobQueue]:
+    """Monta a fila a partir das variáveis de ambiente; None se o banco de jobs não abrir"""
+    try:
+        store = JobStore(os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite3"))
+    except Exception as e:
+        print(f"Warning: Fila de jobs indisponível ({str(e)}). Use os endpoints síncronos.")
+        return None
+    return JobQueue(
+        store,
+        runner,
+        workers=int(os.getenv("JOB_WORKERS", "4")),
+        retention=float(os.getenv("JOB_RETENTION", "604800")),
+        stale_after=float(os.getenv("JOB_STALE_AFTER", "120")),
+        sweep_interval=float(os.getenv("JOB_SWEEP_INTERVAL", "30"))
+    )
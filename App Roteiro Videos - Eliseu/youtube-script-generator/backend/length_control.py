@@ -0,0 +1,302 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+from script_utils import ScriptUtils
+from metrics import metrics
+
+class LengthController:
+    """
+    Controle determinístico do tamanho do roteiro por seção
+
+    Em vez de pedir ao modelo para "expandir" o roteiro inteiro até acertar o
+    total, distribui o orçamento de palavras entre as seções, mede cada seção
+    com ScriptUtils e corrige só as que erraram: seções curtas são regeneradas
+    individualmente e seções longas são aparadas localmente, sem LLM.
+
+    A tolerância por seção (±15%) é bem mais larga que a janela do roteiro
+    inteiro (±50 palavras), então a diferença que sobra no total é repartida
+    entre as maiores seções antes de corrigir.
+    """
+
+    WORDS_PER_MINUTE = 155
+
+    # Palavras-chave que abrem uma nova seção; outros marcadores entre colchetes
+    # (ex.: [INDICAÇÃO VISUAL]) pertencem à seção corrente
+    SECTION_KEYWORDS = {
+        "hook": ("GANCHO",),
+        "intro": ("INTRODUÇÃO", "INTRODUCAO"),
+        "development": ("DESENVOLVIMENTO",),
+        "climax": ("CLÍMAX", "CLIMAX"),
+        "conclusion": ("CONCLUSÃO", "CONCLUSAO"),
+        "cta": ("CTA", "CALL TO ACTION"),
+    }
+
+    # Fração do total de palavras de cada seção (desenvolvimento é dividido entre os pontos)
+    SECTION_SHARES = {
+        "hook": 0.03,
+        "intro": 0.07,
+        "development": 0.70,
+        "climax": 0.08,
+        "conclusion": 0.07,
+        "cta": 0.05,
+    }
+
+    def __init__(self, tolerance: float = 0.15, margin_words: int = 50):
+        self.tolerance = tolerance
+        self.margin_words = margin_words
+        self.script_utils = ScriptUtils()
+
+    def target_words(self, target_minutes: int) -> int:
+        return target_minutes * self.WORDS_PER_MINUTE
+
+    def word_window(self, target_minutes: int) -> tuple:
+        target = self.target_words(target_minutes)
+        return target - self.margin_words, target + self.margin_words
+
+    def development_points(self, target_minutes: int) -> int:
+        # Mesma escala de pontos principais usada pelo roteirista
+        if target_minutes <= 5:
+            return 3
+        elif target_minutes <= 10:
+            return 4
+        elif target_minutes <= 20:
+            return 6
+        return 8
+
+    def allocate(self, target_minutes: int, development_points: Optional[int] = None) -> List[Dict]:
+        """
+        Distribui o orçamento de palavras entre as seções do roteiro
+
+        Args:
+            target_minutes: Duração alvo em minutos
+            development_points: Número de pontos de desenvolvimento (padrão pela duração)
+
+        Returns:
+            Lista de seções com 'kind', 'title' e 'words' (orçamento)
+        """
+        target = self.target_words(target_minutes)
+        points = development_points or self.development_points(target_minutes)
+
+        budgets = [
+            {"kind": "hook", "title": "GANCHO", "words": round(target * self.SECTION_SHARES["hook"])},
+            {"kind": "intro", "title": "INTRODUÇÃO", "words": round(target * self.SECTION_SHARES["intro"])},
+        ]
+        per_point = round(target * self.SECTION_SHARES["development"] / points)
+        for i in range(1, points + 1):
+            budgets.append({"kind": "development", "title": f"DESENVOLVIMENTO - ponto {i}", "words": per_point})
+        for kind, title in (("climax", "CLÍMAX"), ("conclusion", "CONCLUSÃO"), ("cta", "CTA")):
+            budgets.append({"kind": kind, "title": title, "words": round(target * self.SECTION_SHARES[kind])})
+
+        return budgets
+
+    def format_budget_instructions(self, budgets: List[Dict]) -> str:
+        """Texto com o orçamento por seção para incluir nos prompts"""
+        lines = [f"- [{budget['title']}]: ~{budget['words']} palavras faladas" for budget in budgets]
+        total = sum(budget['words'] for budget in budgets)
+        return "ORÇAMENTO DE PALAVRAS POR SEÇÃO (total ~{}):\n        {}".format(total, "\n        ".join(lines))
+
+    def _section_kind(self, marker: str) -> Optional[str]:
+        title = marker.strip("[] ").upper()
+        for kind, keywords in self.SECTION_KEYWORDS.items():
+            if any(title.startswith(keyword) for keyword in keywords):
+                return kind
+        return None
+
+    def is_section_marker(self, line: str) -> bool:
+        """Se a linha é um marcador que abre uma seção (ex.: [GANCHO - 10 segundos])"""
+        stripped = line.strip()
+        return bool(re.match(r'^\[.+\]$', stripped)) and self._section_kind(stripped) is not None
+
+    def split_sections(self, script: str) -> List[Dict]:
+        """
+        Divide o roteiro nas seções marcadas com [TÍTULO]
+
+        Returns:
+            Lista de seções com 'kind', 'title' e 'text' (incluindo o marcador).
+            Texto antes da primeira seção reconhecida vira uma seção 'preamble'.
+        """
+        sections = []
+        current = {"kind": "preamble", "title": "", "lines": []}
+
+        for line in script.split('\n'):
+            stripped = line.strip()
+            kind = self._section_kind(stripped) if re.match(r'^\[.+\]$', stripped) else None
+            if kind:
+                sections.append(current)
+                current = {"kind": kind, "title": stripped.strip("[] "), "lines": []}
+            current["lines"].append(line)
+        sections.append(current)
+
+        result = []
+        for section in sections:
+            text = '\n'.join(section["lines"]).strip()
+            if text:
+                result.append({"kind": section["kind"], "title": section["title"], "text": text})
+        return result
+
+    def measure(self, script: str, target_minutes: int) -> List[Dict]:
+        """
+        Mede cada seção contra o seu orçamento
+
+        Returns:
+            Seções com 'words', 'budget' e 'status' ('ok', 'short', 'long' ou 'unbudgeted')
+        """
+        sections = self.split_sections(script)
+        target = self.target_words(target_minutes)
+        development_count = sum(1 for section in sections if section["kind"] == "development") or 1
+
+        for section in sections:
+            _, words = self.script_utils.extract_spoken_words(section["text"])
+            section["words"] = words
+
+            if section["kind"] == "preamble":
+                section["budget"] = None
+                section["status"] = "unbudgeted"
+                continue
+
+            share = self.SECTION_SHARES[section["kind"]]
+            if section["kind"] == "development":
+                share = share / development_count
+            budget = round(target * share)
+            section["budget"] = budget
+
+            if words < budget * (1 - self.tolerance):
+                section["status"] = "short"
+            elif words > budget * (1 + self.tolerance):
+                section["status"] = "long"
+            else:
+                section["status"] = "ok"
+
+        return sections
+
+    def plan(self, sections: List[Dict], target_minutes: int) -> List[Dict]:
+        """
+        Define a meta de palavras ('goal') de cada seção medida
+
+        Seções fora da tolerância vão para o orçamento. Se mesmo assim o total
+        ficar fora da janela, a diferença é distribuída entre as seções maiores
+        (menos chamadas para o mesmo número de palavras), sem passar da
+        tolerância de cada uma. O 'status' passa a refletir a meta: 'short' se
+        precisa crescer, 'long' se precisa encolher.
+
+        Returns:
+            As próprias seções, com 'goal' e 'status' atualizados
+        """
+        budgeted = [section for section in sections if section["budget"] is not None]
+        for section in budgeted:
+            section["goal"] = section["budget"] if section["status"] in ("short", "long") else section["words"]
+
+        planned = sum(section["goal"] for section in budgeted)
+        planned += sum(section["words"] for section in sections if section["budget"] is None)
+        min_words, max_words = self.word_window(target_minutes)
+
+        if not min_words <= planned <= max_words:
+            gap = self.target_words(target_minutes) - planned
+            for section in sorted(budgeted, key=lambda section: -section["budget"]):
+                if abs(gap) <= self.margin_words // 2:
+                    break
+                if gap > 0:
+                    change = min(gap, round(section["budget"] * (1 + self.tolerance)) - section["goal"])
+                else:
+                    change = max(gap, round(section["budget"] * (1 - self.tolerance)) - section["goal"])
+                if change * gap <= 0:
+                    continue
+                section["goal"] += change
+                gap -= change
+
+        for section in budgeted:
+            if section["goal"] > section["words"]:
+                section["status"] = "short"
+            elif section["goal"] < section["words"]:
+                section["status"] = "long"
+            else:
+                section["status"] = "ok"
+
+        return sections
+
+    def trim_section(self, text: str, budget: int) -> str:
+        """
+        Apara uma seção localmente, removendo frases do fim de cada fala
+        (da última para a primeira) até chegar ao orçamento
+
+        Para na fronteira de frase mais próxima do orçamento, mesmo que fique
+        um pouco acima: cortar sempre para baixo somaria uma sobra negativa
+        por seção e tiraria o roteiro inteiro da janela.
+        """
+        lines = text.split('\n')
+        _, words = self.script_utils.extract_spoken_words(text)
+        settled = False
+
+        for index in range(len(lines) - 1, -1, -1):
+            if settled or words <= budget:
+                break
+            line = lines[index]
+            if not line.strip() or re.match(r'^\s*\[.+\]\s*$', line):
+                continue
+
+            sentences = re.split(r'(?<=[.!?…])\s+', line.rstrip())
+            # Mantém ao menos a primeira frase de cada fala
+            while len(sentences) > 1 and words > budget:
+                removed_words = len(sentences[-1].split())
+                if budget - (words - removed_words) > words - budget:
+                    settled = True
+                    break
+                sentences.pop()
+                words -= removed_words
+            lines[index] = ' '.join(sentences)
+
+        return '\n'.join(lines)
+
+    async def adjust(self, script: str, target_minutes: int,
+                     regenerate_section: Callable[[Dict], Awaitable[str]]) -> str:
+        """
+        Corrige só as seções que precisam mudar para o total caber na janela
+
+        Seções curtas são regeneradas em paralelo via regenerate_section (que
+        recebe a seção medida, com a meta em 'goal', e devolve o novo texto da
+        seção); seções longas são aparadas localmente.
+
+        Args:
+            script: Roteiro completo
+            target_minutes: Duração alvo em minutos
+            regenerate_section: Coroutine que reescreve uma seção para o seu orçamento
+
+        Returns:
+            O roteiro com as seções corrigidas
+        """
+        sections = self.plan(self.measure(script, target_minutes), target_minutes)
+        short = [section for section in sections if section["status"] == "short"]
+        long = [section for section in sections if section["status"] == "long"]
+
+        metrics.increment("length_control.scripts")
+        metrics.increment("length_control.sections_checked", len(sections))
+        if short:
+            metrics.increment("length_control.scripts_with_retry")
+            metrics.increment("length_control.sections_regenerated", len(short))
+        if long:
+            metrics.increment("length_control.sections_trimmed", len(long))
+
+        for section in long:
+            section["text"] = self.trim_section(section["text"], section["goal"])
+
+        if short:
+            results = await asyncio.gather(*(regenerate_section(section) for section in short), return_exceptions=True)
+            for section, result in zip(short, results):
+                if isinstance(result, Exception):
+                    print(f"Erro ao regenerar seção '{section['title']}': {str(result)}")
+                elif result and result.strip():
+                    section["text"] = result.strip()
+
+        return '\n\n'.join(section["text"] for section in sections)
+
+    def strip_preamble(self, script: str) -> str:
+        """Remove o que vier antes da primeira seção (ex.: cabeçalho de tempo do revisor)"""
+        sections = self.split_sections(script)
+        if not any(section["kind"] != "preamble" for section in sections):
+            return script
+        return '\n\n'.join(section["text"] for section in sections if section["kind"] != "preamble")
+
+    def within_window(self, script: str, target_minutes: int) -> bool:
+        min_words, max_words = self.word_window(target_minutes)
+        _, words = self.script_utils.extract_spoken_words(script)
+        return min_words <= words <= max_words
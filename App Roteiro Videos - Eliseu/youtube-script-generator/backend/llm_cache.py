@@ -0,0 +1,60 @@
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+from disk_cache import DiskCache
+
+class LLMResponseCache:
+    """
+    Cache de respostas do LLM endereçado por conteúdo (opt-in via LLM_CACHE_ENABLED)
+
+    A chave é o hash de modelo + temperatura + prompt renderizado, então só
+    acerta quando o prompt é idêntico. Usado nos estágios que dependem apenas
+    dos vídeos, do tópico e do modelo (pesquisador e analista).
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+        ttl = os.getenv("LLM_CACHE_TTL", "604800")  # 7 dias; vazio = sem expiração
+        self.ttl = float(ttl) if ttl else None
+        self.bypassed = 0
+        self._lock = threading.Lock()
+        self.cache = self._open_cache() if self.enabled else None
+
+    def _open_cache(self) -> Optional[DiskCache]:
+        cache_path = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3")
+        try:
+            max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+            return DiskCache(cache_path, max_bytes=max_bytes)
+        except Exception as e:
+            print(f"Warning: Cache de respostas do LLM indisponível ({str(e)}). Seguindo sem cache.")
+            return None
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"llm:{model}:{temperature}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.cache:
+            return None
+        value = self.cache.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, content: str) -> None:
+        if self.cache:
+            self.cache.set(key, content.encode("utf-8"), ttl=self.ttl)
+
+    def count_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> Dict:
+        if not self.cache:
+            return {"enabled": False}
+        stats = self.cache.stats()
+        stats["enabled"] = True
+        stats["bypassed"] = self.bypassed
+        return stats
+
+response_cache = LLMResponseCache()
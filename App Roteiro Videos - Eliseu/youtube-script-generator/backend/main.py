@@ -1,13 +1,22 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import asyncio
 import json
+import os
+import uuid
 
 from youtube_client import YouTubeClient
-from agents import MultiAgentSystem
+from agents import RegenerationConflict, agent_registry
+from video_context import VideoContextStore
+from llm_cache import response_cache
+from checkpoints import checkpoint_store
+from jobs import create_job_queue
+from admission import AdmissionRejected, AdmissionSlot, create_admission_controller
+from metrics import metrics as app_metrics
 from auth_middleware import get_current_user, get_optional_user
 
 app = FastAPI(title="YouTube Script Generator API")
@@ -24,25 +33,87 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Video-Context-Id", "X-Generation-Id"],
 )
 
 youtube_client = YouTubeClient()
-agent_system = MultiAgentSystem()
+# Sistemas multiagente reutilizáveis por provider (o padrão já nasce aquecido)
+agent_system = agent_registry.get()
+video_context_store = VideoContextStore()
+# Intervalo para checar se o cliente do SSE desconectou enquanto nenhum evento chega
+DISCONNECT_POLL_SECONDS = 1.0
+# Intervalo de consulta ao banco quando o job roda em outro processo
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# Limites de gerações simultâneas (global e por usuário) com fila de espera limitada
+admission = create_admission_controller()
+
+async def run_generation_job(job: Dict, progress_callback) -> str:
+    """
+    Executa um job da fila; se ele já tinha checkpoint (processo reiniciado no meio), retoma de lá
+    """
+    payload = job["payload"]
+    current_agent_system = agent_registry.get(payload.get("model_provider"))
+    
+    # Jobs já passaram pelo limite por usuário no envio; aqui só contam no limite global
+    slot = await admission.acquire(job["owner_id"], background=True)
+    try:
+        checkpoint = await asyncio.to_thread(checkpoint_store.load, job["generation_id"])
+        if checkpoint and checkpoint.get("owner_id") != job["owner_id"]:
+            raise RuntimeError("Checkpoint da geração pertence a outro usuário")
+        if checkpoint:
+            return await current_agent_system.resume_script(
+                checkpoint,
+                progress_callback=progress_callback,
+                stream_tokens=payload.get("stream_tokens", True),
+                bypass_llm_cache=payload.get("bypass_llm_cache", False)
+            )
+        
+        return await current_agent_system.generate_script(
+            videos=payload["videos"],
+            topic=payload["topic"],
+            target_minutes=payload["target_minutes"],
+            personality_prompt=payload.get("personality_prompt"),
+            model_provider=payload.get("model_provider"),
+            progress_callback=progress_callback,
+            stream_tokens=payload.get("stream_tokens", True),
+            bypass_llm_cache=payload.get("bypass_llm_cache", False),
+            drafting_mode=payload.get("drafting_mode"),
+            generation_id=job["generation_id"],
+            owner_id=job["owner_id"]
+        )
+    finally:
+        slot.release()
+
+# Gerações em segundo plano com concorrência limitada (JOB_WORKERS)
+job_queue = create_job_queue(run_generation_job)
+
+@app.on_event("startup")
+async def start_job_queue():
+    if job_queue:
+        await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    if job_queue:
+        await job_queue.stop()
 
 class SearchRequest(BaseModel):
     topic: str
     max_results: int = 10
+    slim: bool = False  # Só metadados + has_transcript; transcrição via /api/videos/{id}/transcript
 
 class DateSearchRequest(BaseModel):
     topic: str
     published_after: str = None  # Format: 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM:SSZ'
     published_before: str = None # Format: 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM:SSZ'
     max_results: int = 10
+    slim: bool = False
 
 class TrendingRequest(BaseModel):
     topic: str
     days: int = 7  # Últimos X dias
     max_results: int = 10
+    slim: bool = False
 
 class VideoResponse(BaseModel):
     id: str
@@ -54,22 +125,187 @@ class VideoResponse(BaseModel):
     likes: int
     link: str
     publishedAt: str
+    has_transcript: bool = False
 
 class ScriptGenerationRequest(BaseModel):
     topic: str
-    videos: List[Dict]
+    videos: List[Dict] = []
+    video_context_id: Optional[str] = None  # Handle retornado no header X-Video-Context-Id da busca
+    video_ids: Optional[List[str]] = None  # Alternativa ao handle: IDs de vídeos já buscados
     target_minutes: int = 10
     personality_prompt: str = None
     model_provider: str = "gpt-4.1"  # "gpt-4.1", "gpt-5", "claude-sonnet-4", "claude-opus-4.1"
+    stream_tokens: bool = True  # Só no SSE: transmite os tokens dos estágios finais
+    bypass_llm_cache: bool = False  # Força novas chamadas mesmo com o cache do LLM habilitado
+    drafting_mode: Optional[str] = None  # "single", "sections" ou "auto" (padrão: SCRIPT_DRAFTING_MODE)
 
 class ScriptResponse(BaseModel):
     script: str
     topic: str
+    generation_id: Optional[str] = None
+
+class ResumeRequest(BaseModel):
+    bypass_llm_cache: bool = False
+
+class RegenerateRequest(BaseModel):
+    personality_prompt: Optional[str] = None  # None = mantém o estilo anterior ("" volta ao tom do Eliseu)
+    target_minutes: Optional[int] = None  # None = mantém a duração anterior
+    bypass_llm_cache: bool = False
+
+async def register_video_context(videos: List[Dict], response: Response) -> None:
+    """
+    Registra os vídeos enriquecidos no servidor e devolve o handle no header da resposta
+    """
+    try:
+        context_id = await asyncio.to_thread(video_context_store.register, videos)
+    except Exception as e:
+        print(f"Erro ao registrar contexto de vídeos: {str(e)}")
+        return
+    if context_id:
+        response.headers["X-Video-Context-Id"] = context_id
+
+def build_search_response(videos: List[Dict], slim: bool, response: Response):
+    """
+    No modo slim monta a resposta só com os metadados, sem passar os dicts
+    com transcrição pela validação do response_model
+    """
+    if not slim:
+        return videos
+    
+    fields = VideoResponse.model_fields.keys()
+    content = [{field: video.get(field, False if field == 'has_transcript' else None) for field in fields} for video in videos]
+    headers = {}
+    if "X-Video-Context-Id" in response.headers:
+        headers["X-Video-Context-Id"] = response.headers["X-Video-Context-Id"]
+    return JSONResponse(content=content, headers=headers)
+
+async def resolve_request_videos(request: ScriptGenerationRequest) -> List[Dict]:
+    """
+    Resolve os vídeos da geração e refaz os resumos das transcrições para o tema pedido
+    
+    O resumo guardado na busca foi ranqueado contra o termo pesquisado, que pode
+    não ser o tema desta geração; a transcrição completa está junto, então o
+    resumo é recalculado aqui.
+    """
+    videos = await load_request_videos(request)
+    return await asyncio.to_thread(summarize_for_topic, videos, request.topic)
+
+def summarize_for_topic(videos: List[Dict], topic: str) -> List[Dict]:
+    transcript_extractor = youtube_client.transcript_extractor
+    summarized = []
+    for video in videos:
+        if video.get('transcript'):
+            video = {
+                **video,
+                'transcript_summary': transcript_extractor.get_transcript_summary(video['transcript'], max_length=1000, topic=topic)
+            }
+        summarized.append(video)
+    return summarized
+
+async def load_request_videos(request: ScriptGenerationRequest) -> List[Dict]:
+    """
+    Carrega os vídeos da geração: lista enviada, handle de contexto ou IDs
+    """
+    if request.videos:
+        # Vídeos vindos do navegador não trazem transcrição (has_transcript vem, o texto não);
+        # completa com o que está no servidor
+        ids_to_hydrate = [
+            v['id'] for v in request.videos
+            if 'id' in v and ('transcript_summary' not in v or 'transcript' not in v)
+        ]
+        if not ids_to_hydrate:
+            return request.videos
+        stored, _ = await asyncio.to_thread(video_context_store.get_videos, ids_to_hydrate)
+        stored_by_id = {v['id']: v for v in stored}
+        videos = [{**stored_by_id.get(v.get('id'), {}), **v} for v in request.videos]
+        for video in videos:
+            # Sem o texto no servidor (contexto expirou) o vídeo não pode ser tratado como transcrito
+            if video.get('has_transcript') and not video.get('transcript_summary'):
+                video['has_transcript'] = False
+        return videos
+    
+    if request.video_context_id:
+        videos = await asyncio.to_thread(video_context_store.get_context, request.video_context_id)
+        if videos is None:
+            raise HTTPException(status_code=404, detail="Contexto de vídeos não encontrado ou expirado. Refaça a busca.")
+        return videos
+    
+    if request.video_ids:
+        videos, missing = await asyncio.to_thread(video_context_store.get_videos, request.video_ids)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Vídeos não encontrados no servidor: {', '.join(missing)}")
+        return videos
+    
+    return []
+
+async def load_owned_checkpoint(generation_id: str, current_user: dict) -> Dict:
+    """
+    Busca o checkpoint de uma geração do usuário atual (404 se não existir ou for de outro usuário)
+    """
+    checkpoint = await asyncio.to_thread(checkpoint_store.load, generation_id)
+    if not checkpoint or checkpoint.get("owner_id") != current_user.get("user_id"):
+        raise HTTPException(status_code=404, detail="Geração não encontrada ou expirada.")
+    return checkpoint
+
+async def admit_generation(current_user: dict) -> AdmissionSlot:
+    """
+    Reserva uma vaga de geração para o usuário ou responde 429/503 com Retry-After
+    """
+    try:
+        return await admission.acquire(current_user.get("user_id"))
+    except AdmissionRejected as e:
+        print(f"DEBUG: Geração recusada ({e.status_code}) para {current_user.get('email', 'unknown')}: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+async def load_owned_job(job_id: str, current_user: dict) -> Dict:
+    """
+    Busca um job do usuário atual (404 se não existir ou for de outro usuário)
+    """
+    if not job_queue:
+        raise HTTPException(status_code=503, detail="Fila de jobs indisponível.")
+    job = await asyncio.to_thread(job_queue.store.get, job_id)
+    if not job or job["owner_id"] != current_user.get("user_id"):
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return job
+
+def job_final_event(job: Dict) -> Dict:
+    """Evento SSE final de um job já terminado, montado a partir do banco"""
+    if job["status"] == "failed":
+        return {"type": "error", "error": job["error"], "job_id": job["job_id"], "generation_id": job["generation_id"]}
+    return {
+        "type": "done", "step": 5, "total": 5, "agent": "🎉 Concluído", "description": "Roteiro pronto!",
+        "percentage": 100, "script": job["result"], "job_id": job["job_id"], "generation_id": job["generation_id"]
+    }
 
 @app.get("/")
 async def root():
     return {"message": "YouTube Script Generator API", "version": "1.0.0"}
 
+@app.get("/api/metrics")
+async def metrics(current_user: dict = Depends(get_current_user)):
+    """
+    Contadores de cache e de coalescência de chamadas ao upstream
+    """
+    transcript_extractor = youtube_client.transcript_extractor
+    length_checked = app_metrics.get("length_control.scripts")
+    completed = app_metrics.get("generation.completed")
+    return {
+        "search_cache": youtube_client.search_cache.stats(),
+        "transcript_cache": transcript_extractor.cache.stats() if transcript_extractor.cache else None,
+        "llm_cache": response_cache.stats(),
+        "counters": app_metrics.snapshot(),
+        "jobs": job_queue.stats() if job_queue else None,
+        "admission": admission.stats(),
+        "generation": {
+            "length_retry_rate": app_metrics.get("length_control.scripts_with_retry") / length_checked if length_checked else None,
+            "output_tokens_per_script": app_metrics.get("generation.output_tokens") / completed if completed else None
+        },
+        "singleflight": {
+            "youtube_search": youtube_client.search_flight.stats(),
+            "transcript": transcript_extractor.flight.stats()
+        }
+    }
+
 @app.post("/api/test-auth")
 async def test_auth(current_user: dict = Depends(get_current_user)):
     """
@@ -92,16 +328,16 @@ async def test_script_request(request: ScriptGenerationRequest, current_user: di
     Endpoint de teste com o mesmo modelo do generate-script
     """
     print("DEBUG: [test-script-request] Endpoint executado com sucesso!")
-    print(f"DEBUG: Dados recebidos - topic: {request.topic}, videos: {len(request.videos)}")
+    print(f"DEBUG: Dados recebidos - topic: {request.topic}, videos: {len(request.videos)}, context: {request.video_context_id}")
     return {"message": "Script request working", "user": current_user.get('email', 'unknown')}
 
 @app.post("/api/search-videos", response_model=List[VideoResponse])
-async def search_videos(request: SearchRequest, current_user: dict = Depends(get_current_user)):
+async def search_videos(request: SearchRequest, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Busca vídeos em alta sobre um tópico específico
     """
     try:
-        videos = youtube_client.search_trending_videos(
+        videos = await youtube_client.search_trending_videos_async(
             query=request.topic,
             max_results=request.max_results
         )
@@ -109,101 +345,368 @@ async def search_videos(request: SearchRequest, current_user: dict = Depends(get
         if not videos:
             raise HTTPException(status_code=404, detail="Nenhum vídeo encontrado para este tópico")
         
-        return videos
+        await register_video_context(videos, response)
+        return build_search_response(videos, request.slim, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar vídeos: {str(e)}")
 
+@app.get("/api/videos/{video_id}/transcript")
+async def get_video_transcript(video_id: str, summary: bool = False, topic: Optional[str] = None,
+                               current_user: dict = Depends(get_current_user)):
+    """
+    Busca sob demanda a transcrição (ou o resumo) de um vídeo
+    
+    A transcrição completa é transmitida direto do cache quando presente;
+    caso contrário é extraída (e cacheada) antes de responder. Com topic, o
+    resumo traz os trechos mais relevantes para esse tema.
+    """
+    transcript_extractor = youtube_client.transcript_extractor
+    
+    if summary and not topic:
+        stored, _ = await asyncio.to_thread(video_context_store.get_videos, [video_id])
+        if stored and stored[0].get('transcript_summary'):
+            return PlainTextResponse(stored[0]['transcript_summary'])
+    elif not summary:
+        chunks = await asyncio.to_thread(transcript_extractor.open_cached_transcript, video_id)
+        if chunks is not None:
+            return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+    
+    # Lê do cache quando presente; o resumo por tema é calculado sobre o texto completo
+    transcript = await asyncio.to_thread(transcript_extractor.extract_transcript, video_id)
+    if not transcript:
+        raise HTTPException(status_code=404, detail="Transcrição não disponível para este vídeo")
+    
+    if summary:
+        summary_text = await asyncio.to_thread(
+            transcript_extractor.get_transcript_summary, transcript, 1000, topic
+        )
+        return PlainTextResponse(summary_text)
+    return PlainTextResponse(transcript)
+
 @app.post("/api/generate-script", response_model=ScriptResponse)
 async def generate_script(request: ScriptGenerationRequest, current_user: dict = Depends(get_current_user)):
     """
     Gera um roteiro baseado nos vídeos encontrados usando o sistema multiagente
     """
+    # Sempre gerado pelo servidor: um id escolhido pelo cliente poderia sobrescrever outra geração
+    generation_id = uuid.uuid4().hex
     try:
         print(f"DEBUG: Iniciando geração de roteiro para user: {current_user.get('email', 'unknown')}")
-        print(f"DEBUG: Número de vídeos recebidos: {len(request.videos) if request.videos else 0}")
+        videos = await resolve_request_videos(request)
+        print(f"DEBUG: Número de vídeos recebidos: {len(videos)}")
         
-        if not request.videos:
+        if not videos:
             print("DEBUG: Erro - nenhum vídeo fornecido")
             raise HTTPException(status_code=400, detail="É necessário fornecer vídeos para gerar o roteiro")
         
         print(f"DEBUG: Usando modelo: {request.model_provider}")
         
-        # Criar instância do sistema baseado no provider
-        current_agent_system = MultiAgentSystem(model_provider=request.model_provider)
+        # Reutiliza o sistema do provider (cliente HTTP e grafo compilado)
+        current_agent_system = agent_registry.get(request.model_provider)
         
-        print("DEBUG: Chamando generate_script...")
-        script = await current_agent_system.generate_script(
-            videos=request.videos,
-            topic=request.topic,
-            target_minutes=request.target_minutes,
-            personality_prompt=request.personality_prompt,
-            model_provider=request.model_provider
-        )
+        slot = await admit_generation(current_user)
+        try:
+            print(f"DEBUG: Chamando generate_script (generation_id={generation_id})...")
+            script = await current_agent_system.generate_script(
+                videos=videos,
+                topic=request.topic,
+                target_minutes=request.target_minutes,
+                personality_prompt=request.personality_prompt,
+                model_provider=request.model_provider,
+                bypass_llm_cache=request.bypass_llm_cache,
+                drafting_mode=request.drafting_mode,
+                generation_id=generation_id,
+                owner_id=current_user.get("user_id")
+            )
+        finally:
+            slot.release()
         
         print("DEBUG: Script gerado com sucesso")
-        return ScriptResponse(script=script, topic=request.topic)
+        return ScriptResponse(script=script, topic=request.topic, generation_id=generation_id)
     except HTTPException as he:
         print(f"DEBUG: HTTPException capturada: {he.status_code} - {he.detail}")
         raise
     except Exception as e:
         print(f"DEBUG: Exceção geral capturada: {type(e).__name__}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar roteiro: {str(e)}")
+        # O header permite retomar com POST /api/generations/{id}/resume
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao gerar roteiro: {str(e)}",
+            headers={"X-Generation-Id": generation_id}
+        )
 
 @app.post("/api/generate-script-with-progress")
-async def generate_script_with_progress(request: ScriptGenerationRequest, current_user: dict = Depends(get_current_user)):
+async def generate_script_with_progress(request: ScriptGenerationRequest, http_request: Request, current_user: dict = Depends(get_current_user)):
     """
     Gera um roteiro com atualizações de progresso via SSE
+    
+    Se o cliente desconectar, a geração é cancelada (inclusive a chamada ao
+    provider em andamento) para não pagar pelo resto do pipeline.
     """
+    generation_id = uuid.uuid4().hex
+    # Admissão antes de abrir o stream, para que a recusa seja um 429/503 de verdade
+    slot = await admit_generation(current_user)
+    
     async def event_generator():
+        script_task = None
         try:
             # Envia progresso inicial
-            yield f"data: {json.dumps({'step': 0, 'total': 5, 'agent': '🚀 Iniciando', 'description': 'Preparando sistema...', 'percentage': 0})}\n\n"
-            await asyncio.sleep(0.5)
+            yield f"data: {json.dumps({'type': 'progress', 'step': 0, 'total': 5, 'agent': '🚀 Iniciando', 'description': 'Preparando sistema...', 'percentage': 0, 'generation_id': generation_id})}\n\n"
             
-            # Simula progresso através dos agentes
-            agents = [
-                {"step": 1, "name": "🔍 Pesquisador", "description": "Analisando vídeos em alta...", "percentage": 20},
-                {"step": 2, "name": "📊 Analista", "description": "Identificando tendências virais...", "percentage": 40},
-                {"step": 3, "name": "✍️ Roteirista", "description": "Criando estrutura do roteiro...", "percentage": 60},
-                {"step": 4, "name": "🎙️ Eliseu", "description": "Aplicando estilo e personalidade...", "percentage": 80},
-                {"step": 5, "name": "✅ Revisor", "description": "Finalizando e ajustando tempo...", "percentage": 95}
-            ]
+            videos = await resolve_request_videos(request)
             
-            # Criar instância do sistema baseado no provider
-            current_agent_system = MultiAgentSystem(model_provider=request.model_provider)
+            # Reutiliza o sistema do provider (cliente HTTP e grafo compilado)
+            current_agent_system = agent_registry.get(request.model_provider)
             
-            # Gera o script em paralelo
+            # Gera o script em paralelo; os nós do grafo publicam início/fim na fila
+            progress_events = asyncio.Queue()
             script_task = asyncio.create_task(current_agent_system.generate_script(
-                videos=request.videos,
+                videos=videos,
                 topic=request.topic,
                 target_minutes=request.target_minutes,
                 personality_prompt=request.personality_prompt,
-                model_provider=request.model_provider
+                model_provider=request.model_provider,
+                progress_callback=progress_events.put_nowait,
+                stream_tokens=request.stream_tokens,
+                bypass_llm_cache=request.bypass_llm_cache,
+                drafting_mode=request.drafting_mode,
+                generation_id=generation_id,
+                owner_id=current_user.get("user_id")
             ))
             
-            # Simula progresso dos agentes
-            for agent in agents:
-                yield f"data: {json.dumps({'step': agent['step'], 'total': 5, 'agent': agent['name'], 'description': agent['description'], 'percentage': agent['percentage']})}\n\n"
-                await asyncio.sleep(2)  # Simula tempo de processamento
+            # Repassa os eventos reais até o grafo terminar, checando se o cliente ainda está lá
+            next_event = None
+            while True:
+                if next_event is None:
+                    next_event = asyncio.create_task(progress_events.get())
+                done, _ = await asyncio.wait(
+                    {next_event, script_task}, timeout=DISCONNECT_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event in done:
+                    yield f"data: {json.dumps(next_event.result())}\n\n"
+                    next_event = None
+                elif script_task in done:
+                    next_event.cancel()
+                    break
+                elif await http_request.is_disconnected():
+                    next_event.cancel()
+                    print(f"DEBUG: Cliente desconectou; cancelando geração {generation_id}")
+                    return
+            
+            while not progress_events.empty():
+                yield f"data: {json.dumps(progress_events.get_nowait())}\n\n"
             
-            # Aguarda o script ficar pronto
             script = await script_task
             
             # Envia resultado final
-            yield f"data: {json.dumps({'step': 5, 'total': 5, 'agent': '🎉 Concluído', 'description': 'Roteiro pronto!', 'percentage': 100, 'script': script})}\n\n"
+            yield f"data: {json.dumps({'type': 'done', 'step': 5, 'total': 5, 'agent': '🎉 Concluído', 'description': 'Roteiro pronto!', 'percentage': 100, 'script': script, 'generation_id': generation_id})}\n\n"
             
+        except HTTPException as he:
+            yield f"data: {json.dumps({'type': 'error', 'error': he.detail})}\n\n"
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e), 'generation_id': generation_id})}\n\n"
+        finally:
+            # Cobre a desconexão detectada acima e o fechamento do stream pelo servidor
+            if script_task and not script_task.done():
+                script_task.cancel()
+            slot.release()
+    
+    # A task de fundo cobre o caso do stream nunca chegar a ser iterado (release é idempotente)
+    return StreamingResponse(event_generator(), media_type="text/event-stream", background=BackgroundTask(slot.release))
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: ScriptGenerationRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Enfileira uma geração em segundo plano e devolve o job_id na hora
+    
+    O progresso pode ser acompanhado por GET /api/jobs/{job_id} (polling) ou
+    GET /api/jobs/{job_id}/events (SSE), inclusive após reconectar.
+    """
+    if not job_queue:
+        raise HTTPException(status_code=503, detail="Fila de jobs indisponível.")
+    
+    videos = await resolve_request_videos(request)
+    if not videos:
+        raise HTTPException(status_code=400, detail="É necessário fornecer vídeos para gerar o roteiro")
+    
+    user_active = await asyncio.to_thread(job_queue.store.count_active, current_user.get("user_id"))
+    try:
+        admission.check_backlog(user_active, job_queue.pending)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    
+    payload = request.model_dump(exclude={"videos", "video_context_id", "video_ids"})
+    payload["videos"] = videos
+    job = await job_queue.submit(payload, owner_id=current_user.get("user_id"))
+    
+    return {
+        "job_id": job["job_id"],
+        "generation_id": job["generation_id"],
+        "status": job["status"],
+        "queued": job_queue.pending
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Status de um job; traz o roteiro quando concluído
+    """
+    job = await load_owned_job(job_id, current_user)
+    return {
+        "job_id": job_id,
+        "generation_id": job["generation_id"],
+        "status": job["status"],
+        "topic": job["payload"]["topic"],
+        "script": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    SSE com o progresso de um job; pode ser aberto (ou reaberto) a qualquer
+    momento e começa pelos eventos que já aconteceram
+    """
+    job = await load_owned_job(job_id, current_user)
+    
+    async def poll_store(last_status: Optional[str]):
+        # O job não está (ou deixou de estar) neste processo: já terminou ou
+        # roda em outro worker. Sem histórico local, acompanha pelo banco
+        while True:
+            current = await asyncio.to_thread(job_queue.store.get, job_id)
+            if current["status"] not in ("queued", "running"):
+                yield f"data: {json.dumps(job_final_event(current))}\n\n"
+                return
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"data: {json.dumps({'type': 'job', 'status': last_status, 'job_id': job_id, 'generation_id': current['generation_id']})}\n\n"
+            await asyncio.sleep(JOB_POLL_SECONDS)
+    
+    async def event_generator():
+        events = job_queue.subscribe(job_id) if job["status"] in ("queued", "running") else None
+        if events is None:
+            async for event in poll_store(None):
+                yield event
+            return
+        
+        try:
+            yield f"data: {json.dumps({'type': 'job', 'status': job['status'], 'job_id': job_id, 'generation_id': job['generation_id']})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    if job_queue.is_tracking(job_id):
+                        continue
+                    # Outro worker pegou o job (claim atômico): os eventos não chegam aqui
+                    async for event in poll_store(job["status"]):
+                        yield event
+                    break
+                yield f"data: {json.dumps(event)}\n\n"
+                if event.get("type") in ("done", "error"):
+                    break
+        finally:
+            job_queue.unsubscribe(job_id, events)
     
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+@app.get("/api/generations/{generation_id}")
+async def get_generation(generation_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Estado salvo de uma geração: último nó concluído e se pode ser retomada
+    """
+    checkpoint = await load_owned_checkpoint(generation_id, current_user)
+    return {
+        "generation_id": generation_id,
+        "status": checkpoint["status"],
+        "last_node": checkpoint["last_node"],
+        "error": checkpoint.get("error"),
+        "updated_at": checkpoint["updated_at"],
+        "resumable": checkpoint_store.is_resumable(checkpoint)
+    }
+
+@app.post("/api/generations/{generation_id}/resume", response_model=ScriptResponse)
+async def resume_generation(generation_id: str, request: ResumeRequest = ResumeRequest(), current_user: dict = Depends(get_current_user)):
+    """
+    Retoma uma geração que falhou a partir do último nó concluído, sem refazer
+    as chamadas ao LLM que já deram certo
+    """
+    checkpoint = await load_owned_checkpoint(generation_id, current_user)
+    state = checkpoint["state"]
+    
+    if checkpoint["status"] == "completed":
+        slot = await admit_generation(current_user)
+    else:
+        # Transição atômica para "running": de dois resumes simultâneos, só um passa
+        if not await asyncio.to_thread(checkpoint_store.claim, generation_id):
+            raise HTTPException(status_code=409, detail="Esta geração ainda está em andamento.")
+        try:
+            slot = await admit_generation(current_user)
+        except HTTPException:
+            # Recusado pela admissão: devolve a geração ao estado retomável
+            await asyncio.to_thread(
+                checkpoint_store.mark_failed, generation_id, checkpoint.get("error") or "Retomada recusada pela admissão"
+            )
+            raise
+    try:
+        current_agent_system = agent_registry.get(state.get("model_provider"))
+        script = await current_agent_system.resume_script(checkpoint, bypass_llm_cache=request.bypass_llm_cache)
+        return ScriptResponse(script=script, topic=state["topic"], generation_id=generation_id)
+    except Exception as e:
+        print(f"DEBUG: Falha ao retomar geração {generation_id}: {type(e).__name__}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao retomar roteiro: {str(e)}",
+            headers={"X-Generation-Id": generation_id}
+        )
+    finally:
+        slot.release()
+
+@app.post("/api/generations/{generation_id}/regenerate", response_model=ScriptResponse)
+async def regenerate_generation(generation_id: str, request: RegenerateRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Gera uma nova versão de um roteiro mudando estilo e/ou duração, reexecutando
+    só os estágios afetados (pesquisa e análise são reaproveitadas)
+    """
+    if request.personality_prompt is None and request.target_minutes is None:
+        raise HTTPException(status_code=400, detail="Informe personality_prompt e/ou target_minutes.")
+    
+    checkpoint = await load_owned_checkpoint(generation_id, current_user)
+    state = checkpoint["state"]
+    new_generation_id = uuid.uuid4().hex
+    slot = await admit_generation(current_user)
+    try:
+        current_agent_system = agent_registry.get(state.get("model_provider"))
+        script = await current_agent_system.regenerate_script(
+            checkpoint,
+            changes={"personality_prompt": request.personality_prompt, "target_minutes": request.target_minutes},
+            generation_id=new_generation_id,
+            owner_id=current_user.get("user_id"),
+            bypass_llm_cache=request.bypass_llm_cache
+        )
+        return ScriptResponse(script=script, topic=state["topic"], generation_id=new_generation_id)
+    except RegenerationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"DEBUG: Falha ao regenerar a partir de {generation_id}: {type(e).__name__}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao regenerar roteiro: {str(e)}",
+            headers={"X-Generation-Id": new_generation_id}
+        )
+    finally:
+        slot.release()
+
 @app.post("/api/complete-flow")
 async def complete_flow(request: ScriptGenerationRequest, current_user: dict = Depends(get_current_user)):
     """
     Endpoint que executa o fluxo completo: busca vídeos e gera roteiro
     """
+    slot = await admit_generation(current_user)
     try:
-        videos = youtube_client.search_trending_videos(
+        videos = await youtube_client.search_trending_videos_async(
             query=request.topic,
             max_results=request.max_results
         )
@@ -225,14 +728,16 @@ async def complete_flow(request: ScriptGenerationRequest, current_user: dict = D
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no processamento: {str(e)}")
+    finally:
+        slot.release()
 
 @app.post("/api/search-videos-by-date", response_model=List[VideoResponse])
-async def search_videos_by_date(request: DateSearchRequest, current_user: dict = Depends(get_current_user)):
+async def search_videos_by_date(request: DateSearchRequest, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Busca vídeos em alta por período específico
     """
     try:
-        videos = youtube_client.search_trending_videos_by_date(
+        videos = await youtube_client.search_trending_videos_by_date_async(
             query=request.topic,
             published_after=request.published_after,
             published_before=request.published_before,
@@ -242,17 +747,18 @@ async def search_videos_by_date(request: DateSearchRequest, current_user: dict =
         if not videos:
             raise HTTPException(status_code=404, detail="Nenhum vídeo encontrado para este período")
         
-        return videos
+        await register_video_context(videos, response)
+        return build_search_response(videos, request.slim, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar vídeos por data: {str(e)}")
 
 @app.post("/api/search-trending-recent", response_model=List[VideoResponse])
-async def search_trending_recent(request: TrendingRequest, current_user: dict = Depends(get_current_user)):
+async def search_trending_recent(request: TrendingRequest, response: Response, current_user: dict = Depends(get_current_user)):
     """
     Busca vídeos mais hypados dos últimos X dias
     """
     try:
-        videos = youtube_client.get_trending_last_days(
+        videos = await youtube_client.get_trending_last_days_async(
             query=request.topic,
             days=request.days,
             max_results=request.max_results
@@ -261,7 +767,8 @@ async def search_trending_recent(request: TrendingRequest, current_user: dict =
         if not videos:
             raise HTTPException(status_code=404, detail=f"Nenhum vídeo hypado encontrado nos últimos {request.days} dias")
         
-        return videos
+        await register_video_context(videos, response)
+        return build_search_response(videos, request.slim, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar vídeos recentes: {str(e)}")
 
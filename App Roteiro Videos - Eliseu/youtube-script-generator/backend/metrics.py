@@ -0,0 +1,23 @@
+import threading
+from typing import Dict
+
+class Metrics:
+    """Contadores em memória do processo, expostos em /api/metrics"""
+
+    def __init__(self):
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+metrics = Metrics()
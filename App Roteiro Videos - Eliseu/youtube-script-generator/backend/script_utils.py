@@ -1,5 +1,5 @@
 import re
-from typing import Tuple
+from typing import List, Tuple
 
 class ScriptUtils:
     """Utilitários para processar e analisar roteiros"""
@@ -125,6 +125,72 @@ class ScriptUtils:
         
         return durations
     
+    @staticmethod
+    def format_duration_header(word_count: int) -> str:
+        """
+        Monta o cabeçalho de tempo estimado que o revisor coloca no roteiro final
+        
+        Args:
+            word_count: Número de palavras faladas
+            
+        Returns:
+            Bloco de texto com as durações nas 3 velocidades
+        """
+        durations = ScriptUtils.calculate_all_durations(word_count)
+        return (
+            "📅 TEMPO ESTIMADO DE LEITURA:\n"
+            f"🐌 Lenta (130 wpm): {durations['lenta']['formatted']}\n"
+            f"🎯 Normal (155 wpm): {durations['normal']['formatted']}\n"
+            f"🚀 Rápida (184 wpm): {durations['rapida']['formatted']}\n"
+            "\n"
+            f"📈 Palavras faladas: {word_count}"
+        )
+    
+    @staticmethod
+    def check_script_format(script: str, speaker_prefix: str = "Eliseu 👤:") -> List[str]:
+        """
+        Verifica se o roteiro já está no formato profissional exigido pelo revisor
+        
+        Args:
+            script: Roteiro a verificar
+            speaker_prefix: Prefixo obrigatório das falas
+            
+        Returns:
+            Lista de problemas encontrados (vazia se o formato estiver correto)
+        """
+        lines = [line.strip() for line in script.split('\n') if line.strip()]
+        if not lines:
+            return ["roteiro vazio"]
+        
+        problems = []
+        section_lines = [line for line in lines if re.match(r'^\[.+\]$', line)]
+        other_lines = [line for line in lines if not re.match(r'^\[.+\]$', line)]
+        speech_lines = [line for line in other_lines if line.startswith(speaker_prefix)]
+        
+        if not lines[0].startswith('['):
+            problems.append("não começa com uma seção [ENTRE COLCHETES]")
+        if len(section_lines) < 2:
+            problems.append("poucas seções [ENTRE COLCHETES]")
+        if not speech_lines:
+            problems.append(f"nenhuma fala com '{speaker_prefix}'")
+        elif len(speech_lines) < 0.9 * len(other_lines):
+            problems.append(f"falas sem '{speaker_prefix}'")
+        if re.search(r'\*\*.+?\*\*|^#', script, re.MULTILINE):
+            problems.append("contém formatação markdown")
+        if not lines[-1].startswith(speaker_prefix):
+            problems.append("não termina com uma fala")
+        
+        meta_patterns = [
+            r'\b(este|esse) roteiro\b',
+            r'\bespero que (atenda|goste)',
+            r'\ba estrutura inclui\b',
+            r'\bagora você tem\b',
+        ]
+        if any(re.search(pattern, script, re.IGNORECASE) for pattern in meta_patterns):
+            problems.append("contém comentários sobre o roteiro")
+        
+        return problems
+    
     @staticmethod
     def format_script_with_markers(script: str) -> str:
         """
@@ -0,0 +1,112 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+class SearchCache:
+    """
+    Cache em memória dos resultados de busca com TTL e stale-while-revalidate
+
+    Até ttl segundos a entrada é fresca. Entre ttl e stale_ttl ela ainda é
+    servida imediatamente, mas marcada como "stale" para que o chamador
+    dispare uma atualização em segundo plano. Depois de stale_ttl é descartada.
+    """
+
+    def __init__(self, ttl: float = 900, stale_ttl: float = 86400, max_entries: int = 500):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(search_params: Dict, max_results: int) -> str:
+        """
+        Monta a chave a partir dos parâmetros de search().list já normalizados
+
+        Args:
+            search_params: Parâmetros montados por YouTubeClient._build_search_params
+            max_results: Número máximo de resultados pedido
+        """
+        query = re.sub(r'\s+', ' ', search_params.get('q', '')).strip().lower()
+        return "|".join([
+            query,
+            search_params.get('publishedAfter', ''),
+            search_params.get('publishedBefore', ''),
+            str(max_results)
+        ])
+
+    def get(self, key: str) -> Tuple[Optional[List[Dict]], bool]:
+        """
+        Busca um resultado no cache
+
+        Returns:
+            Tupla (vídeos ou None, está_stale)
+        """
+        if not self.enabled:
+            return None, False
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            stored_at, videos = entry
+            age = now - stored_at
+            if age > self.stale_ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None, False
+
+            self._entries.move_to_end(key)
+            is_stale = age > self.ttl
+            if is_stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+
+        # Cópia rasa para que o chamador possa alterar os dicts sem afetar o cache
+        return [dict(video) for video in videos], is_stale
+
+    def set(self, key: str, videos: List[Dict]) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), [dict(video) for video in videos])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def begin_refresh(self, key: str) -> bool:
+        """Marca a chave como em atualização; retorna False se já houver uma em andamento"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: str) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshing": len(self._refreshing)
+            }
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em andamento (single-flight)
+
+    Enquanto uma chamada para uma chave está em voo, chamadas concorrentes com
+    a mesma chave esperam e recebem o mesmo resultado (ou exceção) em vez de
+    irem ao upstream. Funciona tanto entre threads (do) quanto entre
+    coroutines do mesmo event loop (do_async).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.originated = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._async_calls: Dict[str, asyncio.Task] = {}
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa fn(*args, **kwargs) uma única vez por chave entre threads concorrentes
+
+        Args:
+            key: Identifica chamadas equivalentes
+            fn: Função bloqueante que faz a chamada ao upstream
+
+        Returns:
+            O resultado compartilhado da chamada
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._calls[key] = future
+                self.originated += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def do_async(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Versão assíncrona de do: coroutines concorrentes com a mesma chave
+        aguardam a mesma task
+
+        O cancelamento de um chamador não cancela a chamada compartilhada.
+        """
+        with self._lock:
+            task = self._async_calls.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                self._async_calls[key] = task
+                self.originated += 1
+                task.add_done_callback(lambda _: self._forget_async(key, task))
+
+        return await asyncio.shield(task)
+
+    def _forget_async(self, key: str, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._async_calls.get(key) is task:
+                del self._async_calls[key]
+        # Evita o aviso "exception was never retrieved" quando todos os chamadores foram cancelados
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "originated": self.originated,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls)
+            }
@@ -0,0 +1,56 @@
+import os
+import time
+
+from disk_cache import DiskCache
+
+
+def make_cache(tmp_path, max_bytes=1024 * 1024):
+    return DiskCache(str(tmp_path / "cache.sqlite3"), max_bytes=max_bytes)
+
+
+def test_roundtrip(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("key", b"valor" * 100)
+
+    assert cache.get("key") == b"valor" * 100
+    assert cache.contains("key")
+    assert cache.get("missing") is None
+
+
+def test_entry_expires_after_ttl(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("short", b"valor", ttl=0.05)
+    cache.set("forever", b"valor")
+
+    time.sleep(0.1)
+
+    assert not cache.contains("short")
+    assert cache.get("short") is None
+    assert cache.get("forever") == b"valor"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Bytes aleatórios não comprimem: cada entrada ocupa ~1000 bytes
+    cache = make_cache(tmp_path, max_bytes=3500)
+    for key in ("a", "b", "c"):
+        cache.set(key, os.urandom(1000))
+        time.sleep(0.01)
+
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("d", os.urandom(1000))
+
+    assert cache.get("b") is None
+    assert all(cache.contains(key) for key in ("a", "c", "d"))
+    assert cache.stats()["bytes"] <= 3500
+
+
+def test_update_changes_only_when_callback_returns_value(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("key", b"1")
+
+    assert cache.update("key", lambda value: value + b"2")
+    assert not cache.update("key", lambda value: None)
+    assert not cache.update("missing", lambda value: b"x")
+    assert cache.get("key") == b"12"
+    assert cache.get("missing") is None
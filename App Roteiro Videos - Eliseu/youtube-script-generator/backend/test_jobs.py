@@ -0,0 +1,70 @@
+import threading
+import time
+
+from jobs import JobStore
+
+
+def make_store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_claim_is_exclusive(tmp_path):
+    store = make_store(tmp_path)
+    store.create("job", "user", {"topic": "tema"}, "generation")
+
+    results = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        results.append(store.claim("job"))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    assert store.get("job")["status"] == "running"
+
+
+def test_requeue_stale_only_returns_jobs_without_heartbeat(tmp_path):
+    store = make_store(tmp_path)
+    for job_id in ("orphan", "alive"):
+        store.create(job_id, "user", {"topic": "tema"}, job_id)
+        store.claim(job_id)
+
+    time.sleep(0.1)
+    store.heartbeat(["alive"])
+
+    assert store.requeue_stale(0.05) == ["orphan"]
+    assert store.requeue_stale(0.05) == []
+    assert store.get("orphan")["status"] == "queued"
+    assert store.get("alive")["status"] == "running"
+    assert store.claim("orphan")
+
+
+def test_adopt_stale_queued(tmp_path):
+    store = make_store(tmp_path)
+    for job_id in ("orphan", "alive"):
+        store.create(job_id, "user", {"topic": "tema"}, job_id)
+
+    time.sleep(0.1)
+    store.heartbeat(["alive"])
+
+    assert store.adopt_stale_queued(0.05) == ["orphan"]
+    assert store.adopt_stale_queued(0.05) == []
+
+
+def test_finished_jobs_are_not_requeued(tmp_path):
+    store = make_store(tmp_path)
+    store.create("job", "user", {"topic": "tema"}, "generation")
+    store.claim("job")
+    store.mark_finished("job", result="roteiro")
+
+    time.sleep(0.1)
+
+    assert store.requeue_stale(0.05) == []
+    assert store.get("job")["status"] == "completed"
+    assert store.count_active("user") == 0
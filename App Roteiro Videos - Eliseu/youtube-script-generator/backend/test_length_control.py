@@ -0,0 +1,64 @@
+import asyncio
+
+from length_control import LengthController
+
+
+def section(title, words):
+    sentences = [" ".join(["palavra"] * 9) + " fim." for _ in range(words // 10)]
+    if words % 10:
+        sentences.append(" ".join(["palavra"] * (words % 10)) + ".")
+    return f"[{title}]\nEliseu 👤: " + " ".join(sentences)
+
+
+def build_script(controller, minutes, factor):
+    return "\n\n".join(
+        section(budget["title"], round(budget["words"] * factor))
+        for budget in controller.allocate(minutes)
+    )
+
+
+def test_word_window():
+    controller = LengthController()
+
+    assert controller.target_words(10) == 1550
+    assert controller.word_window(10) == (1500, 1600)
+
+
+def test_on_budget_script_needs_no_changes():
+    controller = LengthController()
+    script = build_script(controller, 10, 1.0)
+
+    sections = controller.plan(controller.measure(script, 10), 10)
+
+    assert controller.within_window(script, 10)
+    assert all(section["status"] == "ok" for section in sections)
+
+
+def test_sections_inside_tolerance_but_total_outside_window():
+    # Cada seção 10% curta passa na tolerância (±15%), mas o total não cabe na janela
+    controller = LengthController()
+    script = build_script(controller, 10, 0.9)
+    assert not controller.within_window(script, 10)
+
+    regenerated = []
+
+    async def regenerate(measured):
+        regenerated.append(measured["title"])
+        return section(measured["title"], measured["goal"])
+
+    adjusted = asyncio.run(controller.adjust(script, 10, regenerate))
+
+    assert controller.within_window(adjusted, 10)
+    assert 0 < len(regenerated) < len(controller.allocate(10))
+
+
+def test_long_sections_are_trimmed_without_llm():
+    controller = LengthController()
+    script = build_script(controller, 10, 1.3)
+
+    async def regenerate(measured):
+        raise AssertionError("seções longas não devem ir para o modelo")
+
+    adjusted = asyncio.run(controller.adjust(script, 10, regenerate))
+
+    assert controller.within_window(adjusted, 10)
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_do_shares_exception_with_all_waiters():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    calls = []
+
+    def failing():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("upstream caiu")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert errors == ["upstream caiu"] * 5
+    assert flight.stats() == {"originated": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_do_runs_again_after_failure():
+    flight = SingleFlight("test")
+
+    def failing():
+        raise ValueError("falhou")
+
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_do_async_shares_exception_with_all_waiters():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream caiu")
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do_async("key", failing) for _ in range(5)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["in_flight"] == 0
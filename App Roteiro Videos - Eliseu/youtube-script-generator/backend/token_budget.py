@@ -0,0 +1,148 @@
+import math
+import os
+import re
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # Dependência opcional: sem ela a contagem é aproximada
+    tiktoken = None
+
+class TokenCounter:
+    """
+    Conta tokens localmente para o provider do sistema
+
+    Com o tiktoken instalado usa o encoding do modelo OpenAI; para o Claude,
+    que não tem tokenizer local, usa o cl100k com um fator de correção. Sem
+    tiktoken cai numa estimativa por caracteres.
+    """
+
+    # Caracteres por token em texto em português (estimativa sem tiktoken)
+    CHARS_PER_TOKEN = 3.5
+    # O tokenizer do Claude gera um pouco mais de tokens que o cl100k
+    ANTHROPIC_FACTOR = 1.15
+
+    def __init__(self, model_provider: str, model_name: Optional[str] = None):
+        self.factor = self.ANTHROPIC_FACTOR if model_provider.startswith("claude") else 1.0
+        self.encoding = self._load_encoding(model_name)
+
+    @staticmethod
+    def _load_encoding(model_name: Optional[str]):
+        if tiktoken is None:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Warning: Encoding do tiktoken indisponível ({str(e)}). Usando contagem aproximada.")
+            return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return math.ceil(len(self.encoding.encode(text)) * self.factor)
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Corta o texto para caber em max_tokens, terminando numa palavra inteira"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+
+        # Reserva um token para as reticências
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)[:max(0, int(max_tokens / self.factor) - 1)]
+            cut = self.encoding.decode(tokens)
+        else:
+            cut = text[:int((max_tokens - 1) * self.CHARS_PER_TOKEN)]
+        # Descarta a palavra que ficou pela metade
+        cut = re.sub(r'\s+\S*$', '', cut) or cut
+        return cut.rstrip() + "..."
+
+class TokenBudget:
+    """
+    Orçamento de tokens de entrada por nó do grafo
+
+    Cada prompt é montado a partir de partes com prioridade: as obrigatórias
+    (prioridade 0) nunca são cortadas e as opcionais (transcrições extras,
+    prévias, referências) são aparadas da menor para a maior prioridade até o
+    total caber no orçamento do nó.
+    """
+
+    DEFAULT_BUDGETS = {
+        "pesquisador": 6000,
+        "analista": 4000,
+        "roteirista": 6000,
+        "eliseu": 9000,
+        "revisor": 9000,
+    }
+
+    def __init__(self, model_provider: str, model_name: Optional[str] = None):
+        self.counter = TokenCounter(model_provider, model_name)
+        self.budgets = dict(self.DEFAULT_BUDGETS)
+        self.budgets.update(self._parse_budgets(os.getenv("TOKEN_BUDGETS", "")))
+        # Teto do personality_prompt, que vem do usuário e entra em vários prompts
+        self.personality_max_tokens = int(os.getenv("PERSONALITY_MAX_TOKENS", "800"))
+
+    @staticmethod
+    def _parse_budgets(raw: str) -> Dict[str, int]:
+        # Formato: "pesquisador=6000,roteirista=5000"
+        budgets = {}
+        for item in raw.split(","):
+            if "=" not in item:
+                continue
+            node, value = item.split("=", 1)
+            try:
+                budgets[node.strip()] = int(value)
+            except ValueError:
+                print(f"Warning: Orçamento de tokens inválido em TOKEN_BUDGETS: {item}")
+        return budgets
+
+    def budget_for(self, agent_name: str) -> Optional[int]:
+        return self.budgets.get(agent_name)
+
+    def cap_personality(self, personality_prompt: str) -> str:
+        return self.counter.truncate(personality_prompt or "", self.personality_max_tokens)
+
+    def fit(self, agent_name: str, template_tokens: int, parts: List[Dict]) -> Dict[str, str]:
+        """
+        Apara as partes opcionais de um prompt até caber no orçamento do nó
+
+        Args:
+            agent_name: Nó do grafo
+            template_tokens: Tokens do texto fixo do prompt (instruções)
+            parts: Partes com 'name', 'text', 'priority' (0 = obrigatória, maior =
+                cortada primeiro) e opcionalmente 'max_tokens' (teto próprio da parte)
+
+        Returns:
+            Texto final de cada parte, por nome
+        """
+        texts = {}
+        counts = {}
+        for part in parts:
+            text = part["text"] or ""
+            if part.get("max_tokens") is not None:
+                text = self.counter.truncate(text, part["max_tokens"])
+            texts[part["name"]] = text
+            counts[part["name"]] = self.counter.count(text)
+
+        budget = self.budget_for(agent_name)
+        if budget is None:
+            return texts
+
+        overflow = template_tokens + sum(counts.values()) - budget
+        optional = sorted((part for part in parts if part["priority"] > 0), key=lambda part: -part["priority"])
+        for part in optional:
+            if overflow <= 0:
+                break
+            name = part["name"]
+            keep = max(0, counts[name] - overflow)
+            texts[name] = self.counter.truncate(texts[name], keep) if keep else ""
+            new_count = self.counter.count(texts[name])
+            overflow -= counts[name] - new_count
+            counts[name] = new_count
+
+        return texts
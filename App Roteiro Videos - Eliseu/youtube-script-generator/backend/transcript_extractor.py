@@ -1,14 +1,66 @@
-from youtube_transcript_api import YouTubeTranscriptApi
-from typing import List, Dict, Optional
+from youtube_transcript_api import (
+    YouTubeTranscriptApi,
+    InvalidVideoId,
+    NoTranscriptAvailable,
+    NoTranscriptFound,
+    TranscriptsDisabled,
+    VideoUnavailable
+)
+from typing import Iterator, List, Dict, Optional
+import itertools
+import asyncio
+import os
 import re
+import time
+from disk_cache import DiskCache
+from singleflight import SingleFlight
+from transcript_index import TranscriptIndex
+
+# Erros que dizem que o vídeo realmente não tem transcrição; os demais
+# (429, falha de rede, timeout) são transitórios e não podem virar cache negativo
+DEFINITIVE_ERRORS = (TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable, VideoUnavailable, InvalidVideoId)
+
+class TranscriptFetchError(Exception):
+    """Falha transitória ao buscar uma transcrição (não deve ser cacheada)"""
 
 class TranscriptExtractor:
     def __init__(self):
         self.languages = ['pt', 'pt-BR', 'en', 'es']  # Prioridade de idiomas
+        # Limites do modo concorrente (extract_multiple_transcripts_async)
+        self.max_concurrency = int(os.getenv("TRANSCRIPT_MAX_CONCURRENCY", "8"))
+        self.per_video_timeout = float(os.getenv("TRANSCRIPT_VIDEO_TIMEOUT", "8"))
+        self.deadline = float(os.getenv("TRANSCRIPT_DEADLINE", "12"))
+        # Candidatos extras buscados junto com os max_videos primeiros (reserva para falhas)
+        self.spare_candidates = int(os.getenv("TRANSCRIPT_SPARE_CANDIDATES", "1"))
+        # Cache persistente compartilhado entre workers (transcrições quase nunca mudam)
+        self.negative_ttl = float(os.getenv("TRANSCRIPT_NEGATIVE_TTL", "21600"))  # 6h para "sem transcrição"
+        self.cache = self._open_cache()
+        # Extrações simultâneas do mesmo vídeo compartilham uma única ida à rede
+        self.flight = SingleFlight("transcript")
+        # Resolução de idioma: lista as faixas uma vez e escolhe localmente em vez de tentar uma a uma
+        self.resolve_languages = os.getenv("TRANSCRIPT_LANGUAGE_RESOLUTION", "true").lower() != "false"
+        # Tamanho (em palavras) dos trechos ranqueados no resumo por tema
+        self.passage_words = int(os.getenv("TRANSCRIPT_PASSAGE_WORDS", "40"))
+    
+    def _open_cache(self) -> Optional[DiskCache]:
+        cache_path = os.getenv("TRANSCRIPT_CACHE_PATH", ".cache/transcripts.sqlite3")
+        if not cache_path:
+            return None
+        try:
+            max_bytes = int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "256")) * 1024 * 1024
+            return DiskCache(cache_path, max_bytes=max_bytes)
+        except Exception as e:
+            print(f"Warning: Cache de transcrições indisponível ({str(e)}). Seguindo sem cache.")
+            return None
+    
+    def _cache_key(self, video_id: str) -> str:
+        return f"transcript:{video_id}:{','.join(self.languages)}"
     
     def extract_transcript(self, video_id: str) -> Optional[str]:
         """
-        Extrai a transcrição de um vídeo do YouTube
+        Extrai a transcrição de um vídeo do YouTube, consultando o cache persistente antes da rede
+        
+        Chamadas concorrentes para o mesmo vídeo são coalescidas em uma só.
         
         Args:
             video_id: ID do vídeo do YouTube
@@ -16,34 +68,195 @@ class TranscriptExtractor:
         Returns:
             Transcrição completa como string ou None se não encontrar
         """
+        return self.flight.do(self._cache_key(video_id), self._extract_transcript_cached, video_id)
+    
+    def _extract_transcript_cached(self, video_id: str) -> Optional[str]:
+        if not self.cache:
+            return self._fetch_transcript_or_none(video_id)
+        
+        key = self._cache_key(video_id)
         try:
-            # Tenta obter transcrições em português primeiro
-            for lang in self.languages[:2]:  # Tenta pt e pt-BR
-                try:
-                    transcript_data = YouTubeTranscriptApi.fetch(video_id, [lang])
-                    return self._format_transcript(transcript_data)
-                except:
-                    continue
-            
-            # Se não encontrou em português, tenta em inglês
-            try:
-                transcript_data = YouTubeTranscriptApi.fetch(video_id, ['en'])
-                return self._format_transcript(transcript_data)
-            except:
-                pass
+            cached = self.cache.get(key)
+        except Exception as e:
+            print(f"Erro ao ler cache de transcrição do vídeo {video_id}: {str(e)}")
+            cached = None
+        
+        if cached is not None:
+            # Entrada vazia = resultado negativo ainda dentro do TTL
+            return cached.decode('utf-8') or None
+        
+        try:
+            transcript = self._fetch_transcript(video_id)
+        except TranscriptFetchError as e:
+            # Transitório: responde sem transcrição agora, mas não grava nada
+            print(f"Erro transitório ao extrair transcrição do vídeo {video_id}: {str(e)}")
+            return None
+        
+        try:
+            if transcript:
+                self.cache.set(key, transcript.encode('utf-8'))
+            else:
+                self.cache.set(key, b"", ttl=self.negative_ttl)
+        except Exception as e:
+            print(f"Erro ao gravar cache de transcrição do vídeo {video_id}: {str(e)}")
+        
+        return transcript
+    
+    def open_cached_transcript(self, video_id: str, chunk_size: int = 65536) -> Optional[Iterator[bytes]]:
+        """
+        Abre a transcrição do cache para streaming, sem tocar na rede
+        
+        Args:
+            video_id: ID do vídeo do YouTube
+            chunk_size: Tamanho máximo de cada pedaço (bytes UTF-8)
             
-            # Como último recurso, tenta obter qualquer transcrição disponível
-            try:
-                transcript_data = YouTubeTranscriptApi.fetch(video_id)
-                return self._format_transcript(transcript_data)
-            except:
-                pass
-                
+        Returns:
+            Iterador de pedaços em UTF-8 ou None se não estiver em cache
+            (ou se o cache guardar um resultado negativo)
+        """
+        if not self.cache:
+            return None
+        
+        compressed = self.cache.get_compressed(self._cache_key(video_id))
+        if compressed is None:
+            return None
+        
+        chunks = DiskCache.iter_decompressed(compressed, chunk_size)
+        first = next(chunks, None)
+        if first is None:
             return None
+        return itertools.chain([first], chunks)
+    
+    def _fetch_transcript_or_none(self, video_id: str) -> Optional[str]:
+        try:
+            return self._fetch_transcript(video_id)
+        except TranscriptFetchError as e:
+            print(f"Erro transitório ao extrair transcrição do vídeo {video_id}: {str(e)}")
+            return None
+    
+    def _fetch_transcript(self, video_id: str) -> Optional[str]:
+        """
+        Extrai a transcrição de um vídeo do YouTube direto da rede
+        
+        Args:
+            video_id: ID do vídeo do YouTube
             
+        Returns:
+            Transcrição completa como string ou None se o vídeo não tiver transcrição
+            
+        Raises:
+            TranscriptFetchError: Falha transitória (rate limit, rede, timeout)
+        """
+        if self.resolve_languages:
+            return self._fetch_transcript_resolved(video_id)
+        return self._fetch_transcript_probing(video_id)
+    
+    def _fetch_transcript_resolved(self, video_id: str) -> Optional[str]:
+        """
+        Lista as faixas disponíveis uma única vez, escolhe a melhor localmente
+        e busca só essa faixa
+        
+        Não há atalho para pular a listagem: na youtube-transcript-api 0.6.2 até
+        get_transcript(languages=[...]) lista as faixas antes de buscar. Quem
+        evita a ida à rede em vídeos já vistos é o cache persistente.
+        
+        Args:
+            video_id: ID do vídeo do YouTube
+            
+        Returns:
+            Transcrição completa como string ou None se não encontrar
+        """
+        try:
+            available = list(YouTubeTranscriptApi.list_transcripts(video_id))
+        except DEFINITIVE_ERRORS as e:
+            print(f"Nenhuma transcrição listada para o vídeo {video_id}: {str(e)}")
+            return None
         except Exception as e:
-            print(f"Erro ao extrair transcrição do vídeo {video_id}: {str(e)}")
+            raise TranscriptFetchError(f"listagem falhou: {str(e)}") from e
+        
+        track = self._pick_track(available)
+        if track is None:
+            return None
+        
+        try:
+            transcript_data = track.fetch()
+        except DEFINITIVE_ERRORS as e:
+            print(f"Erro ao buscar transcrição '{track.language_code}' do vídeo {video_id}: {str(e)}")
             return None
+        except Exception as e:
+            raise TranscriptFetchError(f"faixa '{track.language_code}' falhou: {str(e)}") from e
+        
+        return self._format_transcript(transcript_data)
+    
+    def _pick_track(self, available: List) -> Optional[object]:
+        """
+        Escolhe a melhor faixa seguindo a prioridade de self.languages
+        
+        Para cada idioma, legendas manuais têm preferência sobre as geradas
+        automaticamente. Sem nenhuma correspondência, usa qualquer faixa disponível.
+        
+        Args:
+            available: Faixas retornadas por YouTubeTranscriptApi.list_transcripts
+            
+        Returns:
+            A faixa escolhida ou None se não houver nenhuma
+        """
+        if not available:
+            return None
+        
+        for lang in self.languages:
+            matches = [t for t in available if t.language_code == lang]
+            manual = [t for t in matches if not t.is_generated]
+            if manual:
+                return manual[0]
+            if matches:
+                return matches[0]
+        
+        manual = [t for t in available if not t.is_generated]
+        return manual[0] if manual else available[0]
+    
+    def _fetch_transcript_probing(self, video_id: str) -> Optional[str]:
+        """
+        Modo legado: tenta cada idioma em sequência até um funcionar
+        
+        Usa get_transcript(video_id, languages=[...]), que na youtube-transcript-api
+        0.6.2 lista as faixas a cada tentativa; por isso o modo padrão é o resolvido.
+        
+        Args:
+            video_id: ID do vídeo do YouTube
+            
+        Returns:
+            Transcrição completa como string ou None se não encontrar
+            
+        Raises:
+            TranscriptFetchError: Alguma tentativa falhou de forma transitória
+        """
+        # Só é "sem transcrição" se todas as tentativas falharem de forma definitiva
+        transient_error = None
+        
+        # Tenta português (pt e pt-BR) primeiro, depois inglês
+        for lang in self.languages[:3]:
+            try:
+                transcript_data = YouTubeTranscriptApi.get_transcript(video_id, languages=[lang])
+                return self._format_transcript(transcript_data)
+            except DEFINITIVE_ERRORS:
+                continue
+            except Exception as e:
+                transient_error = e
+        
+        # Como último recurso, usa qualquer transcrição disponível
+        try:
+            available = list(YouTubeTranscriptApi.list_transcripts(video_id))
+            if available:
+                return self._format_transcript(available[0].fetch())
+        except DEFINITIVE_ERRORS:
+            pass
+        except Exception as e:
+            transient_error = e
+        
+        if transient_error is not None:
+            raise TranscriptFetchError(str(transient_error)) from transient_error
+        return None
     
     def _format_transcript(self, transcript_data: List[Dict]) -> str:
         """
@@ -119,13 +332,120 @@ class TranscriptExtractor:
             
         return transcripts
     
-    def get_transcript_summary(self, transcript: str, max_length: int = 500) -> str:
+    async def extract_multiple_transcripts_async(self, video_ids: List[str], max_videos: int = 3,
+                                                 max_concurrency: Optional[int] = None,
+                                                 per_video_timeout: Optional[float] = None,
+                                                 deadline: Optional[float] = None,
+                                                 executor=None) -> Dict[str, str]:
+        """
+        Extrai transcrições de múltiplos vídeos em paralelo
+        
+        Só os max_videos primeiros candidatos (mais uma pequena reserva) são
+        buscados de início; o próximo da fila entra quando algum deles vem sem
+        transcrição. Retorna assim que os max_videos melhores candidatos (na ordem
+        de video_ids) estiverem definidos, ou com o que já chegou quando o
+        deadline estourar.
+        
+        Args:
+            video_ids: Lista de IDs dos vídeos, em ordem de prioridade
+            max_videos: Número máximo de transcrições retornadas
+            max_concurrency: Número máximo de extrações simultâneas
+            per_video_timeout: Tempo máximo (s) por vídeo
+            deadline: Tempo máximo (s) para a operação inteira
+            executor: Executor para as chamadas bloqueantes (padrão do loop se None)
+            
+        Returns:
+            Dicionário com video_id como chave e transcrição como valor
+        """
+        if not video_ids:
+            return {}
+        
+        max_concurrency = max_concurrency or self.max_concurrency
+        per_video_timeout = per_video_timeout or self.per_video_timeout
+        deadline = deadline or self.deadline
+        
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        started_at = time.monotonic()
+        
+        async def fetch_one(video_id: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(executor, self.extract_transcript, video_id),
+                        timeout=per_video_timeout
+                    )
+                except asyncio.TimeoutError:
+                    print(f"Timeout ao extrair transcrição do vídeo {video_id} ({per_video_timeout}s)")
+                    return None
+        
+        candidates = list(dict.fromkeys(video_ids))
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        def is_substantial(task: asyncio.Task) -> bool:
+            if task.cancelled() or task.exception() is not None:
+                return False
+            transcript = task.result()
+            return bool(transcript and len(transcript.strip()) > 100)
+        
+        def launch_needed() -> None:
+            # Mantém em voo só os candidatos que ainda podem ser usados: cada
+            # um que termina sem transcrição libera a vez do próximo da fila
+            alive = sum(1 for task in tasks.values() if not task.done() or is_substantial(task))
+            while alive < max_videos + self.spare_candidates and len(tasks) < len(candidates):
+                video_id = candidates[len(tasks)]
+                tasks[video_id] = asyncio.create_task(fetch_one(video_id))
+                alive += 1
+        
+        def selection_is_final() -> bool:
+            # A seleção só está definida quando nenhum candidato mais bem
+            # ranqueado ainda pode entrar no lugar dos já escolhidos
+            selected = 0
+            for task in tasks.values():
+                if not task.done():
+                    return False
+                if is_substantial(task):
+                    selected += 1
+                    if selected >= max_videos:
+                        return True
+            return len(tasks) == len(candidates)
+        
+        launch_needed()
+        pending = set(tasks.values())
+        try:
+            while pending and not selection_is_final():
+                remaining = deadline - (time.monotonic() - started_at)
+                if remaining <= 0:
+                    print(f"Deadline de {deadline}s atingido - usando {len(tasks) - len(pending)}/{len(candidates)} transcrições recebidas")
+                    break
+                await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                launch_needed()
+                pending = {task for task in tasks.values() if not task.done()}
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        transcripts = {}
+        for video_id, task in tasks.items():
+            if len(transcripts) >= max_videos:
+                break
+            if task.done() and is_substantial(task):  # Só inclui transcrições substanciais
+                transcripts[video_id] = task.result()
+        
+        return transcripts
+    
+    def get_transcript_summary(self, transcript: str, max_length: int = 500, topic: Optional[str] = None) -> str:
         """
         Cria um resumo da transcrição para análise mais eficiente
         
+        Com um tema, monta o resumo com os trechos mais relevantes para ele
+        (ranqueados por BM25), mantendo o gancho inicial e a ordem original.
+        Sem tema, ou se nenhum trecho tiver relação com ele, usa início, meio e fim.
+        
         Args:
             transcript: Transcrição completa
             max_length: Tamanho máximo do resumo em caracteres
+            topic: Tema do vídeo (ex.: termo pesquisado)
             
         Returns:
             Resumo da transcrição
@@ -133,6 +453,15 @@ class TranscriptExtractor:
         if not transcript or len(transcript) <= max_length:
             return transcript
         
+        if topic:
+            selected = TranscriptIndex(transcript, self.passage_words).select(topic, max_length)
+            if selected:
+                summary = selected[0][1]
+                for (previous, _), (position, passage) in zip(selected, selected[1:]):
+                    # Trechos vizinhos continuam a frase; os demais são marcados como salto
+                    summary += (" " if position == previous + 1 else " ... ") + passage
+                return summary
+        
         # Pega o início, meio e fim da transcrição
         part_size = max_length // 3
         
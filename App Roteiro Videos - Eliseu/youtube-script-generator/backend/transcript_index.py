@@ -0,0 +1,131 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# Palavras muito comuns que não ajudam a ranquear trechos (pt, en, es)
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de da do das dos em na no nas nos por para pra pro com sem sob
+e ou mas que se nao sim ja mais menos muito muita muitos muitas pouco tambem so como quando onde
+eu tu ele ela nos vos eles elas voce voces me te lhe meu minha seu sua nosso nossa isso isto
+aquilo esse essa este esta aquele aquela ai ali aqui la entao tipo ne ta to ser estar ter
+foi era sao tem vai vou fazer faz pode gente coisa
+the of and to in is it that for on with as at be this are was you i we they he she or
+el la los las un una y en es que por para con se lo le del al
+""".split())
+
+class TranscriptIndex:
+    """
+    Índice lexical (BM25) sobre os trechos de uma transcrição
+
+    A transcrição é quebrada em trechos de tamanho parecido e cada trecho é
+    pontuado contra o tema do vídeo. Serve para montar resumos com as partes
+    que falam do assunto, em vez de pedaços fixos do início, meio e fim.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, transcript: str, passage_words: int = 40):
+        """
+        Args:
+            transcript: Transcrição completa
+            passage_words: Tamanho aproximado de cada trecho, em palavras
+        """
+        self.passages = self._split_passages(transcript, passage_words)
+        self._term_counts = [Counter(self.tokenize(passage)) for passage in self.passages]
+        self._lengths = [sum(counts.values()) for counts in self._term_counts]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(self.passages)
+        self._idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Minúsculas, sem acentos, sem stopwords e com o plural simples removido"""
+        folded = unicodedata.normalize("NFKD", text.lower())
+        folded = "".join(char for char in folded if not unicodedata.combining(char))
+        return [
+            word[:-1] if len(word) > 3 and word.endswith("s") else word
+            for word in re.findall(r"\w+", folded)
+            if len(word) > 1 and word not in STOPWORDS
+        ]
+
+    @staticmethod
+    def _split_passages(transcript: str, passage_words: int) -> List[str]:
+        # Transcrições automáticas quase não têm pontuação: usa frases quando
+        # existem e junta/quebra para ficar perto de passage_words palavras
+        passages = []
+        current: List[str] = []
+        for sentence in re.split(r'(?<=[.!?])\s+', transcript.strip()):
+            words = sentence.split()
+            while words:
+                room = passage_words - len(current)
+                current.extend(words[:room])
+                words = words[room:]
+                if len(current) >= passage_words:
+                    passages.append(" ".join(current))
+                    current = []
+            if len(current) >= passage_words // 2:
+                passages.append(" ".join(current))
+                current = []
+        if current:
+            passages.append(" ".join(current))
+        return passages
+
+    def score(self, topic: str) -> List[float]:
+        """
+        Pontuação BM25 de cada trecho para o tema
+
+        Returns:
+            Lista de pontuações, na ordem de self.passages
+        """
+        query = set(self.tokenize(topic or ""))
+        scores = []
+        for counts, length in zip(self._term_counts, self._lengths):
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * length / self._avg_length) if self._avg_length else self.K1
+            for term in query:
+                freq = counts.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.K1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, topic: str, max_length: int, keep_opening: bool = True) -> Optional[List[Tuple[int, str]]]:
+        """
+        Escolhe os trechos mais relevantes que cabem em max_length caracteres
+
+        Args:
+            topic: Tema do vídeo (ex.: termo pesquisado)
+            max_length: Orçamento em caracteres (separadores incluídos)
+            keep_opening: Reserva o primeiro trecho (o gancho do vídeo)
+
+        Returns:
+            Trechos escolhidos como (posição, texto) na ordem original,
+            ou None se nenhum trecho tiver relação com o tema
+        """
+        scores = self.score(topic)
+        if not any(scores):
+            return None
+
+        ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i])
+        if keep_opening and self.passages and 0 not in ranked:
+            ranked.insert(0, 0)
+
+        chosen = []
+        used = 0
+        for i in ranked:
+            cost = len(self.passages[i]) + (len(" ... ") if chosen else 0)
+            if used + cost > max_length:
+                continue
+            chosen.append(i)
+            used += cost
+        return [(i, self.passages[i]) for i in sorted(chosen)] or None
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+from typing import List, Dict, Optional, Tuple
+from disk_cache import DiskCache
+
+class VideoContextStore:
+    """
+    Guarda no servidor os vídeos enriquecidos (com transcrição) de cada busca
+
+    A busca registra os vídeos e devolve um handle compacto; os endpoints de
+    geração resolvem o handle (ou uma lista de IDs) daqui em vez de receber as
+    transcrições de volta do navegador. Usa DiskCache, então os handles valem
+    para todos os workers da máquina.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.getenv("VIDEO_CONTEXT_TTL", "86400"))
+        self.cache = self._open_cache()
+
+    def _open_cache(self) -> Optional[DiskCache]:
+        cache_path = os.getenv("VIDEO_CONTEXT_PATH", ".cache/video_contexts.sqlite3")
+        if not cache_path:
+            return None
+        try:
+            max_bytes = int(os.getenv("VIDEO_CONTEXT_MAX_MB", "128")) * 1024 * 1024
+            return DiskCache(cache_path, max_bytes=max_bytes)
+        except Exception as e:
+            print(f"Warning: Armazenamento de contexto de vídeos indisponível ({str(e)}).")
+            return None
+
+    @staticmethod
+    def content_hash(payload: bytes) -> str:
+        return hashlib.sha256(payload).hexdigest()[:24]
+
+    def register(self, videos: List[Dict]) -> Optional[str]:
+        """
+        Registra os vídeos de uma busca
+
+        Cada versão de um vídeo é gravada uma vez, endereçada pelo hash do
+        conteúdo (video_data:{hash}), e o contexto guarda os hashes: um handle
+        sempre resolve os dados com que foi criado, mesmo que uma busca
+        posterior traga outra versão do mesmo vídeo (ex.: sem transcrição por
+        uma falha temporária). video:{id} só aponta para a versão mais recente,
+        para as consultas por ID. O que já existe não é regravado (busca
+        servida do cache): cada gravação comprime a transcrição e roda a
+        varredura de despejo do DiskCache.
+
+        Args:
+            videos: Vídeos já enriquecidos com transcrição
+
+        Returns:
+            O handle do contexto ou None se o armazenamento estiver indisponível
+        """
+        if not self.cache or not videos:
+            return None
+
+        entries = []
+        for video in videos:
+            payload = json.dumps(video, sort_keys=True).encode("utf-8")
+            content_hash = self.content_hash(payload)
+            entries.append([video['id'], content_hash])
+
+            if not self.cache.contains(f"video_data:{content_hash}"):
+                self.cache.set(f"video_data:{content_hash}", payload, ttl=self.ttl)
+            if self.cache.get(f"video:{video['id']}") != content_hash.encode("utf-8"):
+                self.cache.set(f"video:{video['id']}", content_hash.encode("utf-8"), ttl=self.ttl)
+
+        # Endereçado por conteúdo: os mesmos vídeos, nas mesmas versões, geram sempre o mesmo handle
+        context_id = self.content_hash(",".join(content_hash for _, content_hash in entries).encode("utf-8"))
+        if not self.cache.contains(f"context:{context_id}"):
+            self.cache.set(f"context:{context_id}", json.dumps(entries).encode("utf-8"), ttl=self.ttl)
+
+        return context_id
+
+    def get_context(self, context_id: str) -> Optional[List[Dict]]:
+        """
+        Resolve um handle para a lista de vídeos registrada
+
+        Returns:
+            Os vídeos na ordem da busca, como estavam no registro,
+            ou None se o handle não existir / expirou
+        """
+        if not self.cache:
+            return None
+
+        raw = self.cache.get(f"context:{context_id}")
+        if raw is None:
+            return None
+
+        videos = []
+        for entry in json.loads(raw):
+            if not isinstance(entry, list):
+                # Handle do formato antigo (só IDs): trata como expirado
+                return None
+            payload = self.cache.get(f"video_data:{entry[1]}")
+            if payload is None:
+                return None
+            videos.append(json.loads(payload))
+        return videos
+
+    def get_videos(self, video_ids: List[str]) -> Tuple[List[Dict], List[str]]:
+        """
+        Resolve vídeos individuais por ID (versão mais recente de cada um)
+
+        Returns:
+            Tupla (vídeos encontrados, IDs não encontrados)
+        """
+        found = []
+        missing = []
+        for video_id in video_ids:
+            pointer = self.cache.get(f"video:{video_id}") if self.cache else None
+            payload = self.cache.get(f"video_data:{pointer.decode('utf-8')}") if pointer is not None else None
+            if payload is None:
+                missing.append(video_id)
+            else:
+                found.append(json.loads(payload))
+        return found, missing
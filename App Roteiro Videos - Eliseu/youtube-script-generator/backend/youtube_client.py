@@ -1,9 +1,16 @@
 from googleapiclient.discovery import build
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import httplib2
 import os
+import threading
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from transcript_extractor import TranscriptExtractor
+from search_cache import SearchCache
+from singleflight import SingleFlight
 
 load_dotenv()
 
@@ -16,6 +23,26 @@ class YouTubeClient:
         else:
             self.youtube = build('youtube', 'v3', developerKey=self.api_key)
         self.transcript_extractor = TranscriptExtractor()
+        # Pool dedicado para as chamadas bloqueantes do googleapiclient no modo async
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("YOUTUBE_IO_WORKERS", "32")),
+            thread_name_prefix="youtube-io"
+        )
+        # Transcrições ficam num pool separado e limitado: uma extração que estoura
+        # o timeout não pode ser cancelada e seguiria ocupando as threads da API
+        self._transcript_executor = ThreadPoolExecutor(
+            max_workers=self.transcript_extractor.max_concurrency,
+            thread_name_prefix="youtube-transcript"
+        )
+        # Cache de resultados: poupa quota (search().list custa 100 unidades) em tópicos repetidos
+        self.search_cache = SearchCache(
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", "900")),
+            stale_ttl=float(os.getenv("SEARCH_CACHE_STALE_TTL", "86400")),
+            max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))
+        )
+        self._refresh_tasks = set()
+        # Buscas idênticas simultâneas compartilham uma única chamada ao upstream
+        self.search_flight = SingleFlight("youtube_search")
     
     def search_trending_videos(self, query: str, max_results: int = 10) -> List[Dict]:
         """
@@ -26,67 +53,8 @@ class YouTubeClient:
             return []
         
         try:
-            # Busca por relevância primeiro (algoritmo do YouTube considera engagement)
-            search_response = self.youtube.search().list(
-                q=query,
-                type='video',
-                part='id,snippet',
-                maxResults=max_results * 2,  # Busca mais para filtrar depois
-                order='relevance',  # Mudança: relevance considera engagement recente
-                relevanceLanguage='pt',
-                videoDefinition='high',  # Apenas vídeos HD
-                videoDuration='medium'  # Filtra vídeos muito curtos (4-20min)
-            ).execute()
-            
-            video_ids = [item['id']['videoId'] for item in search_response.get('items', [])]
-            
-            if not video_ids:
-                return []
-            
-            videos_response = self.youtube.videos().list(
-                part='snippet,statistics',
-                id=','.join(video_ids)
-            ).execute()
-            
-            videos = []
-            for item in videos_response.get('items', []):
-                stats = item.get('statistics', {})
-                views = int(stats.get('viewCount', 0))
-                likes = int(stats.get('likeCount', 0))
-                comments = int(stats.get('commentCount', 0))
-                
-                # Calcula engagement score (likes + comentários / views)
-                engagement_score = 0
-                if views > 0:
-                    engagement_score = ((likes + comments) / views) * 100
-                
-                # Filtra vídeos com baixo engagement ou muito poucos views
-                if views < 1000 or engagement_score < 0.5:
-                    continue
-                
-                video_data = {
-                    'id': item['id'],
-                    'title': item['snippet']['title'],
-                    'description': item['snippet'].get('description', '')[:200],
-                    'channel': item['snippet']['channelTitle'],
-                    'thumbnail': item['snippet']['thumbnails']['medium']['url'],
-                    'views': views,
-                    'likes': likes,
-                    'comments': comments,
-                    'engagement_score': engagement_score,
-                    'link': f"https://www.youtube.com/watch?v={item['id']}",
-                    'publishedAt': item['snippet']['publishedAt']
-                }
-                videos.append(video_data)
-            
-            # Ordena por engagement score (vídeos mais "hypados") em vez de apenas views
-            videos.sort(key=lambda x: (x['engagement_score'], x['views']), reverse=True)
-            
-            # Extrai transcrições dos melhores vídeos
-            final_videos = videos[:max_results]
-            self._add_transcripts_to_videos(final_videos)
-            
-            return final_videos
+            search_params = self._build_search_params(query, max_results)
+            return self._cached_search(search_params, max_results)
             
         except Exception as e:
             print(f"Erro ao buscar vídeos: {str(e)}")
@@ -108,81 +76,8 @@ class YouTubeClient:
             return []
         
         try:
-            search_params = {
-                'q': query,
-                'type': 'video',
-                'part': 'id,snippet',
-                'maxResults': max_results * 2,  # Busca mais para filtrar depois
-                'order': 'relevance',  # Relevance para considerar engagement
-                'relevanceLanguage': 'pt',
-                'videoDefinition': 'high',
-                'videoDuration': 'medium'
-            }
-            
-            # Adiciona filtros de data se fornecidos
-            if published_after:
-                # Se apenas data (YYYY-MM-DD), adiciona horário
-                if 'T' not in published_after:
-                    published_after += 'T00:00:00Z'
-                search_params['publishedAfter'] = published_after
-                
-            if published_before:
-                # Se apenas data (YYYY-MM-DD), adiciona horário final do dia
-                if 'T' not in published_before:
-                    published_before += 'T23:59:59Z'
-                search_params['publishedBefore'] = published_before
-            
-            search_response = self.youtube.search().list(**search_params).execute()
-            
-            video_ids = [item['id']['videoId'] for item in search_response.get('items', [])]
-            
-            if not video_ids:
-                return []
-            
-            videos_response = self.youtube.videos().list(
-                part='snippet,statistics',
-                id=','.join(video_ids)
-            ).execute()
-            
-            videos = []
-            for item in videos_response.get('items', []):
-                stats = item.get('statistics', {})
-                views = int(stats.get('viewCount', 0))
-                likes = int(stats.get('likeCount', 0))
-                comments = int(stats.get('commentCount', 0))
-                
-                # Calcula engagement score
-                engagement_score = 0
-                if views > 0:
-                    engagement_score = ((likes + comments) / views) * 100
-                
-                # Filtra vídeos com baixo engagement
-                if views < 1000 or engagement_score < 0.5:
-                    continue
-                
-                video_data = {
-                    'id': item['id'],
-                    'title': item['snippet']['title'],
-                    'description': item['snippet'].get('description', '')[:200],
-                    'channel': item['snippet']['channelTitle'],
-                    'thumbnail': item['snippet']['thumbnails']['medium']['url'],
-                    'views': views,
-                    'likes': likes,
-                    'comments': comments,
-                    'engagement_score': engagement_score,
-                    'link': f"https://www.youtube.com/watch?v={item['id']}",
-                    'publishedAt': item['snippet']['publishedAt']
-                }
-                videos.append(video_data)
-            
-            # Ordena por engagement score
-            videos.sort(key=lambda x: (x['engagement_score'], x['views']), reverse=True)
-            
-            # Extrai transcrições dos melhores vídeos
-            final_videos = videos[:max_results]
-            self._add_transcripts_to_videos(final_videos)
-            
-            return final_videos
+            search_params = self._build_search_params(query, max_results, published_after, published_before)
+            return self._cached_search(search_params, max_results)
             
         except Exception as e:
             print(f"Erro ao buscar vídeos por data: {str(e)}")
@@ -200,12 +95,278 @@ class YouTubeClient:
         published_after = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT00:00:00Z')
         return self.search_trending_videos_by_date(query, published_after=published_after, max_results=max_results)
     
-    def _add_transcripts_to_videos(self, videos: List[Dict]) -> None:
+    async def search_trending_videos_async(self, query: str, max_results: int = 10) -> List[Dict]:
+        """
+        Versão assíncrona de search_trending_videos: não bloqueia o event loop
+        durante as chamadas à YouTube API e a extração de transcrições
+        """
+        if not self.youtube:
+            print("YouTube API not available - returning empty results")
+            return []
+        
+        try:
+            search_params = self._build_search_params(query, max_results)
+            return await self._cached_search_async(search_params, max_results)
+        except Exception as e:
+            print(f"Erro ao buscar vídeos: {str(e)}")
+            return []
+    
+    async def search_trending_videos_by_date_async(self, query: str, published_after: Optional[str] = None,
+                                                   published_before: Optional[str] = None, max_results: int = 10) -> List[Dict]:
+        """
+        Versão assíncrona de search_trending_videos_by_date
+        
+        Args:
+            query: Termo de busca
+            published_after: Data no formato 'YYYY-MM-DD' ou 'YYYY-MM-DDTHH:MM:SSZ'
+            published_before: Data no formato 'YYYY-MM-DD' ou 'YYYY-MM-DDTHH:MM:SSZ'
+            max_results: Número máximo de resultados
+        """
+        if not self.youtube:
+            print("YouTube API not available - returning empty results")
+            return []
+        
+        try:
+            search_params = self._build_search_params(query, max_results, published_after, published_before)
+            return await self._cached_search_async(search_params, max_results)
+        except Exception as e:
+            print(f"Erro ao buscar vídeos por data: {str(e)}")
+            return []
+    
+    async def get_trending_last_days_async(self, query: str, days: int = 7, max_results: int = 10) -> List[Dict]:
+        """
+        Versão assíncrona de get_trending_last_days
+        
+        Args:
+            query: Termo de busca
+            days: Número de dias para voltar (padrão 7 dias)
+            max_results: Número máximo de resultados
+        """
+        published_after = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT00:00:00Z')
+        return await self.search_trending_videos_by_date_async(query, published_after=published_after, max_results=max_results)
+    
+    def _cached_search(self, search_params: Dict, max_results: int) -> List[Dict]:
+        """
+        Serve do cache quando possível; se a entrada estiver stale, devolve-a
+        imediatamente e atualiza em uma thread de segundo plano
+        """
+        key = SearchCache.make_key(search_params, max_results)
+        videos, is_stale = self.search_cache.get(key)
+        
+        if videos is not None:
+            if is_stale and self.search_cache.begin_refresh(key):
+                threading.Thread(
+                    target=self._refresh_search,
+                    args=(key, search_params, max_results),
+                    daemon=True
+                ).start()
+            return videos
+        
+        videos = self.search_flight.do(key, self._fetch_and_cache, key, search_params, max_results)
+        # O resultado é compartilhado entre chamadores coalescidos
+        return [dict(video) for video in videos]
+    
+    def _fetch_and_cache(self, key: str, search_params: Dict, max_results: int) -> List[Dict]:
+        videos = self._search_and_enrich(search_params, max_results)
+        if videos:
+            self.search_cache.set(key, videos)
+        return videos
+    
+    def _refresh_search(self, key: str, search_params: Dict, max_results: int) -> None:
+        try:
+            self.search_flight.do(key, self._fetch_and_cache, key, search_params, max_results)
+        except Exception as e:
+            print(f"Erro ao atualizar cache de busca '{search_params.get('q')}': {str(e)}")
+        finally:
+            self.search_cache.end_refresh(key)
+    
+    async def _cached_search_async(self, search_params: Dict, max_results: int) -> List[Dict]:
+        """
+        Versão assíncrona de _cached_search: a atualização em segundo plano roda como task
+        """
+        key = SearchCache.make_key(search_params, max_results)
+        videos, is_stale = self.search_cache.get(key)
+        
+        if videos is not None:
+            if is_stale and self.search_cache.begin_refresh(key):
+                task = asyncio.create_task(self._refresh_search_async(key, search_params, max_results))
+                # Mantém referência para a task não ser coletada antes de terminar
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return videos
+        
+        videos = await self.search_flight.do_async(key, self._fetch_and_cache_async, key, search_params, max_results)
+        return [dict(video) for video in videos]
+    
+    async def _fetch_and_cache_async(self, key: str, search_params: Dict, max_results: int) -> List[Dict]:
+        videos = await self._search_and_enrich_async(search_params, max_results)
+        if videos:
+            self.search_cache.set(key, videos)
+        return videos
+    
+    async def _refresh_search_async(self, key: str, search_params: Dict, max_results: int) -> None:
+        try:
+            await self.search_flight.do_async(key, self._fetch_and_cache_async, key, search_params, max_results)
+        except Exception as e:
+            print(f"Erro ao atualizar cache de busca '{search_params.get('q')}': {str(e)}")
+        finally:
+            self.search_cache.end_refresh(key)
+    
+    def _search_and_enrich(self, search_params: Dict, max_results: int) -> List[Dict]:
+        """
+        Pipeline síncrono: search().list -> videos().list -> transcrições
+        
+        Args:
+            search_params: Parâmetros já montados para search().list
+            max_results: Número máximo de resultados
+        """
+        search_response = self._execute(self.youtube.search().list(**search_params))
+        
+        video_ids = self._extract_video_ids(search_response)
+        
+        if not video_ids:
+            return []
+        
+        videos_response = self._execute(self._videos_list_request(video_ids))
+        
+        # Extrai transcrições dos melhores vídeos
+        final_videos = self._rank_videos(videos_response, max_results)
+        self._add_transcripts_to_videos(final_videos, search_params.get('q'))
+        
+        return final_videos
+    
+    async def _search_and_enrich_async(self, search_params: Dict, max_results: int) -> List[Dict]:
+        """
+        Pipeline assíncrono: search().list -> videos().list -> transcrições
+        
+        Args:
+            search_params: Parâmetros já montados para search().list
+            max_results: Número máximo de resultados
+        """
+        search_response = await self._execute_async(self.youtube.search().list(**search_params))
+        
+        video_ids = self._extract_video_ids(search_response)
+        
+        if not video_ids:
+            return []
+        
+        videos_response = await self._execute_async(self._videos_list_request(video_ids))
+        
+        final_videos = self._rank_videos(videos_response, max_results)
+        await self._add_transcripts_to_videos_async(final_videos, search_params.get('q'))
+        
+        return final_videos
+    
+    def _execute(self, request) -> Dict:
+        """
+        Executa um HttpRequest do googleapiclient
+        
+        O httplib2 não é thread-safe, então cada execução usa sua própria
+        instância de Http em vez da compartilhada pelo objeto de serviço.
+        """
+        return request.execute(http=httplib2.Http())
+    
+    async def _execute_async(self, request) -> Dict:
+        """
+        Executa um HttpRequest do googleapiclient no pool de I/O
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._execute, request))
+    
+    def _build_search_params(self, query: str, max_results: int, published_after: Optional[str] = None,
+                             published_before: Optional[str] = None) -> Dict:
+        """
+        Monta os parâmetros de search().list, incluindo filtros de data opcionais
+        """
+        search_params = {
+            'q': query,
+            'type': 'video',
+            'part': 'id,snippet',
+            'maxResults': max_results * 2,  # Busca mais para filtrar depois
+            'order': 'relevance',  # Relevance considera engagement recente
+            'relevanceLanguage': 'pt',
+            'videoDefinition': 'high',  # Apenas vídeos HD
+            'videoDuration': 'medium'  # Filtra vídeos muito curtos (4-20min)
+        }
+        
+        # Adiciona filtros de data se fornecidos
+        if published_after:
+            # Se apenas data (YYYY-MM-DD), adiciona horário
+            if 'T' not in published_after:
+                published_after += 'T00:00:00Z'
+            search_params['publishedAfter'] = published_after
+            
+        if published_before:
+            # Se apenas data (YYYY-MM-DD), adiciona horário final do dia
+            if 'T' not in published_before:
+                published_before += 'T23:59:59Z'
+            search_params['publishedBefore'] = published_before
+        
+        return search_params
+    
+    def _extract_video_ids(self, search_response: Dict) -> List[str]:
+        return [item['id']['videoId'] for item in search_response.get('items', [])]
+    
+    def _videos_list_request(self, video_ids: List[str]):
+        return self.youtube.videos().list(
+            part='snippet,statistics',
+            id=','.join(video_ids)
+        )
+    
+    def _rank_videos(self, videos_response: Dict, max_results: int) -> List[Dict]:
+        """
+        Filtra e ordena os vídeos retornados por videos().list
+        
+        Args:
+            videos_response: Resposta de videos().list
+            max_results: Número máximo de resultados
+            
+        Returns:
+            Os max_results vídeos com maior engagement
+        """
+        videos = []
+        for item in videos_response.get('items', []):
+            stats = item.get('statistics', {})
+            views = int(stats.get('viewCount', 0))
+            likes = int(stats.get('likeCount', 0))
+            comments = int(stats.get('commentCount', 0))
+            
+            # Calcula engagement score (likes + comentários / views)
+            engagement_score = 0
+            if views > 0:
+                engagement_score = ((likes + comments) / views) * 100
+            
+            # Filtra vídeos com baixo engagement ou muito poucos views
+            if views < 1000 or engagement_score < 0.5:
+                continue
+            
+            video_data = {
+                'id': item['id'],
+                'title': item['snippet']['title'],
+                'description': item['snippet'].get('description', '')[:200],
+                'channel': item['snippet']['channelTitle'],
+                'thumbnail': item['snippet']['thumbnails']['medium']['url'],
+                'views': views,
+                'likes': likes,
+                'comments': comments,
+                'engagement_score': engagement_score,
+                'link': f"https://www.youtube.com/watch?v={item['id']}",
+                'publishedAt': item['snippet']['publishedAt']
+            }
+            videos.append(video_data)
+        
+        # Ordena por engagement score (vídeos mais "hypados") em vez de apenas views
+        videos.sort(key=lambda x: (x['engagement_score'], x['views']), reverse=True)
+        
+        return videos[:max_results]
+    
+    def _add_transcripts_to_videos(self, videos: List[Dict], topic: Optional[str] = None) -> None:
         """
         Adiciona transcrições aos vídeos (máximo 3 para não sobrecarregar)
         
         Args:
             videos: Lista de vídeos para adicionar transcrições
+            topic: Termo pesquisado, usado para escolher os trechos do resumo
         """
         if not videos:
             return
@@ -216,7 +377,39 @@ class YouTubeClient:
         video_ids = [video['id'] for video in videos[:3]]
         transcripts = self.transcript_extractor.extract_multiple_transcripts(video_ids, max_videos=3)
         
-        # Adiciona as transcrições aos dados dos vídeos
+        self._apply_transcripts(videos, transcripts, topic)
+    
+    async def _add_transcripts_to_videos_async(self, videos: List[Dict], topic: Optional[str] = None) -> None:
+        """
+        Versão assíncrona de _add_transcripts_to_videos
+        
+        Args:
+            videos: Lista de vídeos para adicionar transcrições
+            topic: Termo pesquisado, usado para escolher os trechos do resumo
+        """
+        if not videos:
+            return
+        
+        print(f"Extraindo transcrições (até 3) de {len(videos)} candidatos em paralelo...")
+        
+        # Os 3 melhores com transcrição são usados; os demais candidatos só
+        # são buscados quando algum dos primeiros vem sem transcrição
+        video_ids = [video['id'] for video in videos]
+        transcripts = await self.transcript_extractor.extract_multiple_transcripts_async(
+            video_ids, max_videos=3, executor=self._transcript_executor
+        )
+        
+        self._apply_transcripts(videos, transcripts, topic)
+    
+    def _apply_transcripts(self, videos: List[Dict], transcripts: Dict[str, str], topic: Optional[str] = None) -> None:
+        """
+        Adiciona as transcrições extraídas aos dados dos vídeos
+        
+        Args:
+            videos: Lista de vídeos
+            transcripts: Dicionário video_id -> transcrição
+            topic: Termo pesquisado, usado para escolher os trechos do resumo
+        """
         for video in videos:
             video_id = video['id']
             if video_id in transcripts:
@@ -224,7 +417,7 @@ class YouTubeClient:
                 video['transcript'] = transcripts[video_id]
                 # Adiciona resumo para análise mais eficiente
                 video['transcript_summary'] = self.transcript_extractor.get_transcript_summary(
-                    transcripts[video_id], max_length=1000
+                    transcripts[video_id], max_length=1000, topic=topic
                 )
                 video['has_transcript'] = True
                 print(f"✓ Transcrição extraída do vídeo: {video['title'][:50]}...")